@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import io
+import os.path
+import sys
+import tarfile
+import zipfile
+from typing import Generator
+from typing import IO
+from typing import Sequence
+
+from cheetah_lint.watch import TEMPLATE_EXTENSION
+
+TAR_EXTENSIONS = (
+    '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz',
+)
+ZIP_EXTENSIONS = ('.zip',)
+
+
+def is_archive(filename: str) -> bool:
+    return filename.endswith(TAR_EXTENSIONS + ZIP_EXTENSIONS)
+
+
+def _member_name(archive: str, name: str) -> str:
+    # like zipimport, members are named as if the archive was a directory
+    return os.path.join(archive, os.path.normpath(name))
+
+
+def iter_archive(
+        filename: str,
+        fileobj: IO[bytes] | None = None,
+) -> Generator[tuple[str, str], None, None]:
+    """Yields the name and contents of each template in a tar or zip archive
+    without extracting it.
+
+    Tar archives (optionally compressed) are read as a stream, so `fileobj`
+    need not be seekable.
+    """
+    if filename.endswith(TAR_EXTENSIONS):
+        with tarfile.open(filename, 'r|*', fileobj=fileobj) as tar:
+            members = (
+                member for member in tar
+                if member.isfile() and member.name.endswith(TEMPLATE_EXTENSION)
+            )
+            for member in members:
+                contents = tar.extractfile(member)
+                assert contents is not None
+                yield (
+                    _member_name(filename, member.name),
+                    contents.read().decode('UTF-8'),
+                )
+    else:
+        if fileobj is not None and not fileobj.seekable():
+            fileobj = io.BytesIO(fileobj.read())
+        with zipfile.ZipFile(fileobj or filename) as zip_file:
+            infos = (
+                info for info in zip_file.infolist()
+                if not info.is_dir()
+                if info.filename.endswith(TEMPLATE_EXTENSION)
+            )
+            for info in infos:
+                yield (
+                    _member_name(filename, info.filename),
+                    zip_file.read(info).decode('UTF-8'),
+                )
+
+
+def iter_inputs(
+        filenames: Sequence[str],
+        stdin_filename: str | None = None,
+) -> Generator[tuple[str, str | None], None, None]:
+    """Expands `filenames` to the name and contents of each template.
+
+    Archives are expanded to their templates and `-` is read from stdin (as
+    an archive if `stdin_filename` is named like one).  The contents of other
+    files are None, they are read when they are linted.
+    """
+    for filename in filenames:
+        if filename == '-':
+            name = stdin_filename or 'stdin'
+            if is_archive(name):
+                yield from iter_archive(name, sys.stdin.buffer)
+            else:
+                yield name, sys.stdin.read()
+        elif is_archive(filename):
+            yield from iter_archive(filename)
+        else:
+            yield filename, None
@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import collections
+import hashlib
+import json
+import os
+from typing import Any
+from typing import Counter
+from typing import Iterable
+from typing import NamedTuple
+from typing import Sequence
+from typing import Tuple
+
+LintCode = Tuple[int, str, str]
+
+BASELINE_VERSION = 1
+
+
+def content_hash(file_contents: str) -> str:
+    return hashlib.sha256(file_contents.encode('UTF-8')).hexdigest()
+
+
+def fingerprint(code: str, line: str) -> str:
+    """Identifies a finding by its code and the contents of its line, so it
+    still matches after lines are added or removed above it.
+    """
+    h = hashlib.sha256(f'{code}\0{line.strip()}'.encode('UTF-8'))
+    return h.hexdigest()[:20]
+
+
+def _fingerprints(
+        file_contents: str,
+        flakes: Iterable[LintCode],
+) -> list[str]:
+    lines = file_contents.splitlines()
+    return [
+        fingerprint(
+            code, lines[line_no - 1] if 1 <= line_no <= len(lines) else '',
+        )
+        for line_no, code, _ in flakes
+    ]
+
+
+def _is_valid_entry(entry: object) -> bool:
+    return (
+        isinstance(entry, dict) and
+        isinstance(entry.get('hash'), str) and
+        isinstance(entry.get('findings'), dict) and
+        all(
+            isinstance(key, str) and type(count) is int
+            for key, count in entry['findings'].items()
+        )
+    )
+
+
+class BaselineFile(NamedTuple):
+    hash: str
+    findings: Counter[str]
+
+
+class Baseline:
+    """Findings to disregard, per file.
+
+    `codes` are the codes which were enabled when the findings were
+    recorded: a file which did not change since then has no other findings
+    for them.
+
+    `files` are named relative to `root` (the directory of the baseline
+    file), so they match however their paths are given and from wherever
+    the linting is run.
+    """
+
+    def __init__(
+            self,
+            codes: Iterable[str] = (),
+            files: dict[str, BaselineFile] | None = None,
+            root: str = os.curdir,
+    ) -> None:
+        self.codes = frozenset(codes)
+        self.files = {} if files is None else files
+        self.root = os.path.abspath(root)
+
+    def _name(self, filename: str) -> str:
+        try:
+            return os.path.normpath(os.path.relpath(filename, self.root))
+        except ValueError:  # pragma: no cover (windows, another drive)
+            return os.path.abspath(filename)
+
+    @classmethod
+    def load(cls, filename: str) -> Baseline:
+        with open(filename, encoding='UTF-8') as f:
+            contents = json.load(f)
+        if not isinstance(contents, dict):
+            raise ValueError(f'{filename}: not a baseline')
+        if contents.get('version') != BASELINE_VERSION:
+            raise ValueError(
+                f'{filename}: unsupported baseline version '
+                f'{contents.get("version")!r}',
+            )
+        codes, files = contents.get('codes'), contents.get('files')
+        if (
+                not isinstance(codes, list) or
+                not all(isinstance(code, str) for code in codes) or
+                not isinstance(files, dict) or
+                not all(_is_valid_entry(entry) for entry in files.values())
+        ):
+            raise ValueError(f'{filename}: invalid baseline')
+        return cls(
+            codes,
+            {
+                name: BaselineFile(
+                    entry['hash'], collections.Counter(entry['findings']),
+                )
+                for name, entry in files.items()
+            },
+            os.path.dirname(filename),
+        )
+
+    def save(self, filename: str) -> None:
+        contents: dict[str, Any] = {
+            'version': BASELINE_VERSION,
+            'codes': sorted(self.codes),
+            'files': {
+                name: {'hash': entry.hash, 'findings': dict(entry.findings)}
+                for name, entry in self.files.items()
+            },
+        }
+        with open(filename, 'w', encoding='UTF-8') as f:
+            json.dump(contents, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    def is_unchanged(
+            self,
+            filename: str,
+            file_contents: str,
+            codes: frozenset[str],
+    ) -> bool:
+        """Whether all findings for `codes` in the file are in the baseline
+        without linting it.
+        """
+        entry = self.files.get(self._name(filename))
+        return (
+            entry is not None and
+            codes <= self.codes and
+            entry.hash == content_hash(file_contents)
+        )
+
+    def filter(
+            self,
+            filename: str,
+            file_contents: str,
+            flakes: Sequence[LintCode],
+    ) -> tuple[LintCode, ...]:
+        """Removes the findings which are in the baseline.  Each entry
+        matches as many findings as it was recorded for.
+        """
+        entry = self.files.get(self._name(filename))
+        if entry is None or not flakes:
+            return tuple(flakes)
+
+        remaining = entry.findings.copy()
+        keys = _fingerprints(file_contents, flakes)
+        ret = []
+        for lint_code, key in zip(flakes, keys):
+            if remaining[key] > 0:
+                remaining[key] -= 1
+            else:
+                ret.append(lint_code)
+        return tuple(ret)
+
+    def record(
+            self,
+            filename: str,
+            file_contents: str,
+            flakes: Sequence[LintCode],
+    ) -> None:
+        self.files[self._name(filename)] = BaselineFile(
+            content_hash(file_contents),
+            collections.Counter(_fingerprints(file_contents, flakes)),
+        )
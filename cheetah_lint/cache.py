@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import functools
+import hashlib
+import http.client
+import importlib.metadata
+import json
+import platform
+import queue
+import re
+import socket
+import threading
+import urllib.parse
+from typing import Any
+from typing import Iterable
+from typing import List
+from typing import Sequence
+
+# The results for a template as stored in the cache: [[line, code, msg]]
+CachedResult = List[List[Any]]
+
+KEY_RE = re.compile('^[0-9a-f]{64}$')
+# Everything which can change the results for the same template
+VERSIONED_DISTRIBUTIONS = (
+    'cheetah_lint', 'yelp-cheetah', 'flake8', 'pyflakes', 'pycodestyle',
+)
+
+
+@functools.lru_cache(maxsize=None)
+def get_versions(
+        distributions: Sequence[str] = VERSIONED_DISTRIBUTIONS,
+) -> str:
+    versions = [f'python={platform.python_version()}']
+    for name in distributions:
+        try:
+            version = importlib.metadata.version(name)
+        except importlib.metadata.PackageNotFoundError:  # pragma: no cover
+            version = 'unknown'
+        versions.append(f'{name}={version}')
+    return '\n'.join(versions)
+
+
+def cache_key(file_contents: str, options: Iterable[str] = ()) -> str:
+    """Addresses the results for a template linted with `options` (which
+    must include anything besides the template affecting the results) by
+    this and its dependencies' versions.
+    """
+    h = hashlib.sha256()
+    for part in (get_versions(), *options, file_contents):
+        h.update(part.encode('UTF-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def _is_cached_result(value: object) -> bool:
+    return isinstance(value, list) and all(
+        isinstance(lint_code, list) and
+        len(lint_code) == 3 and
+        type(lint_code[0]) is int and
+        isinstance(lint_code[1], str) and
+        isinstance(lint_code[2], str)
+        for lint_code in value
+    )
+
+
+class RemoteCache:
+    """Client for the cache served by `cheetah_lint.cache_server`.
+
+    Lookups are batched, each batch costs one request (`POST /get`).  Stores
+    are sent from a background thread, batching whatever accumulated while
+    the previous batch was sent (`POST /put`).  Both reuse their keep-alive
+    connection.
+
+    The cache is best effort: when the server cannot be reached lookups
+    miss and stores are dropped, the linting is never affected.  After the
+    first failure to reach it (or to get an answer within `timeout`) the
+    server is not contacted again.
+    """
+
+    def __init__(
+            self,
+            url: str,
+            timeout: float = 10.,
+            connect_timeout: float = 1.,
+    ) -> None:
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme == 'https':
+            self._connection_cls: type[http.client.HTTPConnection]
+            self._connection_cls = http.client.HTTPSConnection
+        elif parsed.scheme == 'http':
+            self._connection_cls = http.client.HTTPConnection
+        else:
+            raise ValueError(f'expected an http(s) url, got {url!r}')
+        self._netloc = parsed.netloc
+        self._path = parsed.path.rstrip('/')
+        self._timeout = timeout
+        self._connect_timeout = connect_timeout
+        self._unavailable = threading.Event()
+
+        self._get_connection = self._connect()
+        self._puts: queue.Queue[dict[str, CachedResult] | None]
+        self._puts = queue.Queue()
+        # not waited for at exit when the server stopped answering
+        self._put_thread = threading.Thread(
+            target=self._put_worker, daemon=True,
+        )
+        self._put_thread.start()
+
+    def __enter__(self) -> RemoteCache:
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    def _connect(self) -> http.client.HTTPConnection:
+        return self._connection_cls(
+            self._netloc, timeout=self._connect_timeout,
+        )
+
+    def _open(self, connection: http.client.HTTPConnection) -> None:
+        # connect with `connect_timeout`, then wait longer for the answers
+        connection.connect()
+        connection.sock.settimeout(self._timeout)
+
+    def _post(
+            self,
+            connection: http.client.HTTPConnection,
+            path: str,
+            data: bytes,
+    ) -> tuple[int, str, bytes]:
+        if connection.sock is None:
+            self._open(connection)
+        connection.request(
+            'POST', f'{self._path}{path}', body=data,
+            headers={'Content-Type': 'application/json'},
+        )
+        response = connection.getresponse()
+        return response.status, response.reason, response.read()
+
+    def _request(
+            self,
+            connection: http.client.HTTPConnection,
+            path: str,
+            body: object,
+    ) -> Any:
+        data = json.dumps(body).encode()
+        try:
+            try:
+                status, reason, contents = self._post(connection, path, data)
+            except socket.timeout:
+                raise
+            except (OSError, http.client.HTTPException):
+                # the server may have closed the keep-alive connection since
+                # it was last used, retry once on a new one
+                connection.close()
+                status, reason, contents = self._post(connection, path, data)
+        except (OSError, http.client.HTTPException):
+            self._unavailable.set()
+            connection.close()
+            raise
+        if status != 200:
+            raise http.client.HTTPException(f'{path}: {status} {reason}')
+        return json.loads(contents)
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, CachedResult]:
+        """Returns the cached results of those of `keys` which have one."""
+        keys = list(keys)
+        if not keys or self._unavailable.is_set():
+            return {}
+        try:
+            ret = self._request(self._get_connection, '/get', keys)
+        except (OSError, ValueError, http.client.HTTPException):
+            return {}
+        if not isinstance(ret, dict):
+            return {}
+        return {
+            key: ret[key] for key in keys
+            if key in ret and _is_cached_result(ret[key])
+        }
+
+    def put(self, key: str, result: CachedResult) -> None:
+        """Stores `result` in the background."""
+        self._puts.put({key: result})
+
+    def _put_worker(self) -> None:
+        connection = self._connect()
+        try:
+            done = False
+            while not done:
+                batch: dict[str, CachedResult] = {}
+                item = self._puts.get()
+                while True:
+                    if item is None:
+                        done = True
+                        break
+                    batch.update(item)
+                    try:
+                        item = self._puts.get_nowait()
+                    except queue.Empty:
+                        break
+                if batch and not self._unavailable.is_set():
+                    try:
+                        self._request(connection, '/put', batch)
+                    except (OSError, ValueError, http.client.HTTPException):
+                        pass
+        finally:
+            connection.close()
+
+    def close(self) -> None:
+        """Waits for the pending stores to be sent, unless the server is
+        unavailable.
+        """
+        self._puts.put(None)
+        if not self._unavailable.is_set():
+            self._put_thread.join()
+        self._get_connection.close()
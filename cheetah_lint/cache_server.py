@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import argparse
+import http.server
+import json
+import os
+import tempfile
+import threading
+from typing import Any
+from typing import Sequence
+
+from cheetah_lint.cache import KEY_RE
+
+
+class MemoryStore:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._entries: dict[str, bytes] = {}
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            return self._entries.get(key)
+
+    def put(self, key: str, value: bytes) -> None:
+        with self._lock:
+            self._entries[key] = value
+
+
+class DirectoryStore:
+    """Stores each entry in a file named by its key (in a subdirectory named
+    by the key's first two characters).
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+
+    def _filename(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key: str) -> bytes | None:
+        try:
+            with open(self._filename(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, value: bytes) -> None:
+        filename = self._filename(key)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # concurrent readers only ever see complete entries
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value)
+            os.replace(tmp, filename)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Serves the cache used by `cheetah_lint.cache.RemoteCache`:
+
+    - `GET /KEY`: the entry, 404 if there is none
+    - `PUT /KEY`: store the entry
+    - `POST /get`: a json list of keys, responds with an object of the
+      entries found
+    - `POST /put`: a json object of entries to store
+
+    Entries are json lists, keys are sha256 hex digests.  Only the last
+    component of the path is used, so the server can be mounted anywhere.
+    """
+    protocol_version = 'HTTP/1.1'
+    server: Server
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _respond(self, status: int, body: object = None) -> None:
+        data = b'' if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(data)))
+        if body is not None:
+            self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self) -> Any:
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length))
+
+    def _key(self) -> str | None:
+        key = self.path.rsplit('/', 1)[-1]
+        return key if KEY_RE.match(key) else None
+
+    def do_GET(self) -> None:
+        key = self._key()
+        value = None if key is None else self.server.store.get(key)
+        if value is None:
+            self._respond(404)
+        else:
+            self._respond(200, json.loads(value))
+
+    def do_PUT(self) -> None:
+        key = self._key()
+        try:
+            value = self._read_json()
+        except ValueError:
+            value = None
+        if key is None or not isinstance(value, list):
+            self._respond(400)
+        else:
+            self.server.store.put(key, json.dumps(value).encode())
+            self._respond(204)
+
+    def do_POST(self) -> None:
+        action = self.path.rsplit('/', 1)[-1]
+        try:
+            body = self._read_json()
+        except ValueError:
+            body = None
+
+        if action == 'get' and isinstance(body, list):
+            ret = {}
+            for key in body:
+                if isinstance(key, str) and KEY_RE.match(key):
+                    value = self.server.store.get(key)
+                    if value is not None:
+                        ret[key] = json.loads(value)
+            self._respond(200, ret)
+        elif action == 'put' and isinstance(body, dict):
+            for key, value in body.items():
+                if KEY_RE.match(key) and isinstance(value, list):
+                    self.server.store.put(key, json.dumps(value).encode())
+            self._respond(200, {})
+        else:
+            self._respond(400)
+
+
+class Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+            self,
+            address: tuple[str, int],
+            store: MemoryStore | DirectoryStore,
+            verbose: bool = False,
+    ) -> None:
+        super().__init__(address, Handler)
+        self.store = store
+        self.verbose = verbose
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='Serve a result cache for `cheetah-flake --cache-url`.',
+    )
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument(
+        '--directory', metavar='DIR',
+        help='Store the results in this directory (default: in memory).',
+    )
+    parser.add_argument(
+        '--verbose', action='store_true', help='Log each request.',
+    )
+    args = parser.parse_args(argv)
+
+    store: MemoryStore | DirectoryStore
+    if args.directory is None:
+        store = MemoryStore()
+    else:
+        store = DirectoryStore(args.directory)
+
+    with Server((args.host, args.port), store, args.verbose) as server:
+        print(
+            f'Serving on http://{args.host}:{server.server_port}', flush=True,
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
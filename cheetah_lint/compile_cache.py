@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Any
+from typing import Dict
+from typing import Tuple
+
+from cheetah_lint.cache import get_versions
+
+# The compiled module and its source map, see `flake.compile_for_lint`
+Compiled = Tuple[str, Dict[int, int]]
+
+# Everything which can change the compiled module for the same template
+COMPILE_DISTRIBUTIONS = ('cheetah_lint', 'yelp-cheetah')
+# Evicting stops once the cache is this fraction of its maximum size, so
+# it does not happen again for the next few entries
+EVICT_TO = .9
+
+
+class CompileCache:
+    """Caches compiled templates in `directory`, addressed by the template
+    and the versions of the compiler.  Unlike the results, these do not
+    depend on the checks or the codes which are enabled.
+
+    Entries are evicted least recently used first once there are more than
+    `max_size` bytes of them.  Several processes may share a directory.
+
+    With `deferred`, entries are not stored but collected in `pending`, to
+    be stored by another instance.  `get_flakes_limited`'s subprocesses use
+    such a cache, so they do not each scan the directory for its size.
+    """
+
+    def __init__(
+            self,
+            directory: str,
+            max_size: int,
+            deferred: bool = False,
+    ) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        self.deferred = deferred
+        self.pending: list[tuple[str, Compiled]] = []
+        self._lock = threading.Lock()
+        # unknown until the directory is scanned on the first store
+        self._size: int | None = None
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        return (CompileCache, (self.directory, self.max_size, self.deferred))
+
+    def deferring(self) -> CompileCache:
+        """A cache of the same directory which leaves storing to this one."""
+        return CompileCache(self.directory, self.max_size, deferred=True)
+
+    def _filename(self, file_contents: str) -> str:
+        h = hashlib.sha256()
+        for part in (get_versions(COMPILE_DISTRIBUTIONS), file_contents):
+            h.update(part.encode('UTF-8'))
+            h.update(b'\0')
+        key = h.hexdigest()
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, file_contents: str) -> Compiled | None:
+        filename = self._filename(file_contents)
+        try:
+            with open(filename, encoding='UTF-8') as f:
+                py_source, source_map = json.load(f)
+            if not isinstance(py_source, str):
+                return None
+            source_map = {int(k): v for k, v in source_map.items()}
+            # the modification time orders the entries for eviction
+            os.utime(filename)
+        except (OSError, ValueError, TypeError, AttributeError):
+            return None
+        return py_source, source_map
+
+    def put(self, file_contents: str, compiled: Compiled) -> None:
+        if self.deferred:
+            self.pending.append((file_contents, compiled))
+            return
+
+        filename = self._filename(file_contents)
+        data = json.dumps(compiled).encode('UTF-8')
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            # concurrent readers only ever see complete entries
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp, filename)
+            except BaseException:
+                os.remove(tmp)
+                raise
+        except OSError:  # the cache is best effort
+            return
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, _, size in self._entries())
+            else:
+                self._size += len(data)
+            if self._size > self.max_size:
+                self._evict()
+
+    def _entries(self) -> list[tuple[float, str, int]]:
+        entries = []
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:  # evicted by another process
+                    continue
+                entries.append((stat.st_mtime, path, stat.st_size))
+        return entries
+
+    def _evict(self) -> None:
+        entries = sorted(self._entries())
+        self._size = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if self._size <= self.max_size * EVICT_TO:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
@@ -48,3 +48,17 @@ def _get_imports(xmldoc: lxml.etree.Element, name: str) -> list[CheetahImport]:
 
 def get_all_imports(xmldoc: lxml.etree.Element) -> list[CheetahImport]:
     return [*_get_imports(xmldoc, 'import'), *_get_imports(xmldoc, 'from')]
+
+
+def get_all_imports_in_order(
+        xmldoc: lxml.etree.Element,
+) -> list[CheetahImport]:
+    """Like `get_all_imports` but in the order they appear in the document."""
+    xml_elements = xmldoc.xpath(
+        './Directive['
+        '    SimpleExprDirective/UnbracedExpression/Py[1]['
+        "        text() = 'import' or text() = 'from'"
+        '    ]'
+        ']',
+    )
+    return [CheetahImport(xml_element) for xml_element in xml_elements]
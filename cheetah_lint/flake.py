@@ -1,22 +1,61 @@
 from __future__ import annotations
 
 import argparse
+import contextlib
 import enum
+import functools
+import hashlib
+import itertools
+import multiprocessing
+import multiprocessing.connection
+import os.path
 import re
+import signal
 import subprocess
 import sys
-import tempfile
+import time
 import tokenize
 from typing import Callable
+from typing import ContextManager
+from typing import Dict
+from typing import Generator
+from typing import Iterable
+from typing import NamedTuple
 from typing import Sequence
 from typing import Tuple
 
 from Cheetah.compile import compile_source
+from Cheetah.legacy_compiler import ClassCompiler
 from Cheetah.legacy_compiler import LegacyCompiler
-
+from Cheetah.legacy_compiler import MethodCompiler
+
+from cheetah_lint.archive import is_archive
+from cheetah_lint.archive import iter_inputs
+from cheetah_lint.baseline import Baseline
+from cheetah_lint.cache import cache_key
+from cheetah_lint.cache import RemoteCache
+from cheetah_lint.compile_cache import CompileCache
+from cheetah_lint.compile_cache import Compiled
+from cheetah_lint.jobs import add_jobs_argument
+from cheetah_lint.jobs import map_in_order
+from cheetah_lint.jobs import positive_int
+from cheetah_lint.jobs import pipeline
+from cheetah_lint.memory_report import MemoryReport
+from cheetah_lint.memory_report import no_phase
+from cheetah_lint.shard import add_shard_arguments
+from cheetah_lint.shard import record_duration
+from cheetah_lint.shard import save_durations
+from cheetah_lint.shard import select_files
+from cheetah_lint.util import compile_lock
 from cheetah_lint.util import read_file
+from cheetah_lint.watch import watch
+
+if sys.platform != 'win32':  # pragma: win32 no cover
+    import resource
 
 LintCode = Tuple[int, str, str]
+# python line number -> template line number
+SourceMap = Dict[int, int]
 
 ACCEPTABLE_UNUSED_ASSIGNMENTS = ('_dummyTrans', 'NS')
 UNUSED_ASSIGNMENTS_FLAKE8_MESSAGES = frozenset(
@@ -77,8 +116,173 @@ class NoCompilerSettingsCompiler(LegacyCompiler):
         self.clearStrConst()
 
 
+# Generated lines are tagged with the template line they came from, the tags
+# are removed again by `compile_for_lint`.  Python source cannot contain NUL
+# (`ast.parse` rejects it and string constants are written with `repr`) so
+# the tags cannot be confused with anything the template produced.
+SOURCE_MAP_TAG_RE = re.compile('\0([0-9]+)\0')
+DEF_LINE_RE = re.compile(r' at line ([0-9]+), col [0-9]+\.$')
+
+
+def _tag_lines(code: str, line_no: int) -> str:
+    """Tags each line of `code` (which starts on template line `line_no`)."""
+    return '\n'.join(
+        f'{line}\0{line_no + i}\0'
+        for i, line in enumerate(code.split('\n'))
+    )
+
+
+def _tag_chunk(chunk: str, line_no: int) -> str:
+    # method body chunks start with the newline ending the previous chunk
+    return '\n' + _tag_lines(chunk[1:], line_no)
+
+
+class LintMethodCompiler(MethodCompiler):
+    def commitStrConst(self) -> None:
+        # The linters never look inside the literal markup of a template,
+        # only keep its newlines so the line numbers do not change
+        if not self._pendingStrConstChunks:
+            return
+        newlines = self.getStrConst().count('\n')
+        self.clearStrConst()
+        self.addWriteChunk("'''" + '\n' * newlines + "'''")
+
+    def addFilteredChunk(
+            self,
+            chunk: str,
+            rawExpr: str | None = None,
+            lineCol: tuple[int, int] | None = None,
+    ) -> None:
+        super().addFilteredChunk(chunk, rawExpr, lineCol)
+        # the second chunk writing the value is tagged with its line / col
+        # comment, see below
+        if lineCol is not None:
+            self._methodBodyChunks[-2] = _tag_chunk(
+                self._methodBodyChunks[-2], lineCol[0],
+            )
+
+    def _append_line_col_comment(self, line_col: tuple[int, int]) -> None:
+        self._methodBodyChunks[-1] = _tag_chunk(
+            self._methodBodyChunks[-1], line_col[0],
+        )
+        super()._append_line_col_comment(line_col)
+
+    def methodSignature(self) -> str:
+        signature = super().methodSignature()
+        # the parser only passes the position of the #def in this comment
+        match = DEF_LINE_RE.search(self._initialMethodComment)
+        if match is None:  # the main method
+            return signature
+        else:
+            return signature + f'\0{match[1]}\0'
+
+
+class LintClassCompiler(ClassCompiler):
+    methodCompilerClass = LintMethodCompiler
+
+
+class LintCompiler(NoCompilerSettingsCompiler):
+    """Compiles a module for linting only, it cannot render the template."""
+    classCompilerClass = LintClassCompiler
+
+    def _add_import_statement(
+            self,
+            expr: Sequence[str],
+            line_col: tuple[int, int],
+    ) -> None:
+        super()._add_import_statement(expr, line_col)
+        # compiler settings are not applied, so `useLegacyImportMode` stays
+        # on and every import (also inline ones) goes to the module
+        self._importStatements[-1] = _tag_lines(
+            self._importStatements[-1], line_col[0],
+        )
+
+    addFrom = addImport = _add_import_statement
+
+
+def compile_for_lint(src: str) -> tuple[str, SourceMap]:
+    """Compiles a template with `LintCompiler`, returning the module and a map
+    from its line numbers to the template line numbers they came from.
+
+    Lines which do not come from a specific template line (the scaffolding,
+    literal markup, decorators, ...) are missing from the map.
+    """
+    with compile_lock:
+        tagged = compile_source(src, compiler_cls=LintCompiler)
+
+    py_lines = []
+    source_map = {}
+    for py_line_no, line in enumerate(tagged.splitlines(True), 1):
+        match = SOURCE_MAP_TAG_RE.search(line)
+        if match is not None:
+            source_map[py_line_no] = int(match[1])
+            line = SOURCE_MAP_TAG_RE.sub('', line)
+        py_lines.append(line)
+    return ''.join(py_lines), source_map
+
+
 def to_py(src: str) -> str:
-    return compile_source(src, compiler_cls=NoCompilerSettingsCompiler)
+    py_source, _ = compile_for_lint(src)
+    return py_source
+
+
+def _compile_cached(
+        src: str,
+        compile_cache: CompileCache | None,
+) -> tuple[str, SourceMap]:
+    if compile_cache is None:
+        return compile_for_lint(src)
+    compiled = compile_cache.get(src)
+    if compiled is None:
+        compiled = compile_for_lint(src)
+        compile_cache.put(src, compiled)
+    return compiled
+
+
+def read_precompiled(
+        filename: str,
+        file_contents: str,
+        precompiled_dir: str,
+) -> str | None:
+    """Returns the module yelp-cheetah already compiled for `filename` (with
+    `file_contents`) into `precompiled_dir` (mirroring its path relative to
+    the working directory).
+
+    Returns None when there is no usable module: it is missing or older than
+    the template, or the template has `#compiler-settings` (the build applies
+    them, but `to_py` does not, so the output may differ).
+
+    Only the modification times tell whether the module is up to date: the
+    settings, compiler and yelp-cheetah version it was built with are not
+    recorded in it.  `precompiled_dir` must therefore be built from the
+    current templates (not restored from a cache, say).
+
+    These modules have no source map (see `compile_for_lint`), findings in
+    them are mapped back to the template by their line / col comments and
+    similar template lines.  For the codes which need the exact line
+    (`NEED_LINE_NUMBER_NORMALIZED`) the template is compiled after all.
+    """
+    relative = os.path.relpath(filename)
+    if relative.startswith(os.pardir):
+        return None
+    py_file = os.path.join(
+        precompiled_dir,
+        os.path.dirname(relative),
+        os.path.basename(relative).split('.', 1)[0] + '.py',
+    )
+    try:
+        if os.path.getmtime(py_file) < os.path.getmtime(filename):
+            return None
+        py_source = read_file(py_file)
+    except OSError:
+        return None
+
+    if '\n__YELP_CHEETAH__ = True\n' not in py_source:
+        return None
+    elif '#compiler-settings' in file_contents:
+        return None
+    else:
+        return py_source
 
 
 def filter_known_errors(data: Sequence[LintCode]) -> tuple[LintCode, ...]:
@@ -195,7 +399,12 @@ def _get_line_no(
         py_by_line_no: Sequence[str],
         cheetah_by_line_no: Sequence[str],
         hint: LineNoHint | None = None,
+        source_map: SourceMap | None = None,
 ) -> int:
+    # Use the line recorded while compiling
+    if source_map is not None and py_line_no in source_map:
+        return source_map[py_line_no]
+
     # Attempt to find it by the cheetah compiler comments
     ret = _get_line_no_from_comments(py_by_line_no[py_line_no])
     if ret != 0:
@@ -220,6 +429,7 @@ def _normalize_msg_line_no(
         code: str,
         py_by_line_no: Sequence[str],
         cheetah_by_line_no: Sequence[str],
+        source_map: SourceMap | None = None,
 ) -> str:
     if code not in NEED_LINE_NUMBER_NORMALIZED:
         return msg
@@ -230,7 +440,7 @@ def _normalize_msg_line_no(
     new_line = str(
         _get_line_no(
             line_no, py_by_line_no, cheetah_by_line_no,
-            LineNoHint.FIRST_IMPORT,
+            LineNoHint.FIRST_IMPORT, source_map,
         ),
     )
     return LINE_ERROR_MSG_RE.sub(fr'\g<1>{new_line}', msg)
@@ -242,10 +452,14 @@ def _normalize_line(
         msg: str,
         py_by_line_no: Sequence[str],
         cheetah_by_line_no: Sequence[str],
+        source_map: SourceMap | None = None,
 ) -> tuple[int, str, str]:
-    msg = _normalize_msg_line_no(msg, code, py_by_line_no, cheetah_by_line_no)
+    msg = _normalize_msg_line_no(
+        msg, code, py_by_line_no, cheetah_by_line_no, source_map,
+    )
     line_no = _get_line_no(
         line_no, py_by_line_no, cheetah_by_line_no, LineNoHint.LAST_IMPORT,
+        source_map,
     )
     return line_no, code, msg
 
@@ -254,27 +468,37 @@ def normalize_lines(
         data: Sequence[LintCode],
         py_lines: Sequence[str],
         cheetah_lines: Sequence[str],
+        source_map: SourceMap | None = None,
 ) -> tuple[LintCode, ...]:
+    """Maps the python line numbers in `data` back to the template.
+
+    Lines in `source_map` (see `compile_for_lint`) are exact, the others are
+    found by the line / col comments yelp-cheetah leaves in the module or
+    failing that by searching for similar template lines.
+    """
     # Let's not think about the difference between index and line number
     py_by_line_no = ('',) + tuple(py_lines)
     cheetah_by_line_no = ('',) + tuple(cheetah_lines)
     return tuple(
-        _normalize_line(line_no, code, msg, py_by_line_no, cheetah_by_line_no)
+        _normalize_line(
+            line_no, code, msg, py_by_line_no, cheetah_by_line_no, source_map,
+        )
         for line_no, code, msg in data
     )
 
 
 def check_flake8(py_lines: Sequence[str]) -> tuple[LintCode, ...]:
-    with tempfile.NamedTemporaryFile(suffix='.py') as tmpfile:
-        tmpfile.write(''.join(py_lines).encode('UTF-8'))
-        tmpfile.flush()
-        cmd = (
-            sys.executable, '-mflake8', tmpfile.name,
-            '--format=%(row)s\t%(code)s\t%(text)s',
-            f'--select={SELECTED_ERRORS}',
-        )
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-        out, _ = proc.communicate()
+    # The source is passed on stdin (rather than through a temporary file)
+    # so concurrent calls share nothing
+    cmd = (
+        sys.executable, '-mflake8', '-',
+        '--format=%(row)s\t%(code)s\t%(text)s',
+        f'--select={SELECTED_ERRORS}',
+    )
+    proc = subprocess.Popen(
+        cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+    )
+    out, _ = proc.communicate(''.join(py_lines).encode('UTF-8'))
 
     split = (line.split('\t') for line in out.decode().splitlines())
     ret = [(int(col), code, msg) for col, code, msg in split]
@@ -310,22 +534,130 @@ def check_unicode_literals(py_lines: Sequence[str]) -> tuple[LintCode, ...]:
     return data
 
 
+# Cheapest first, see `fail_fast`
 PY_CHECKS = (
-    check_flake8,
     check_unicode_literals,
+    check_flake8,
 )
+PY_CHECK_CODES = {
+    check_flake8: frozenset(SELECTED_ERRORS.split(',')),
+    check_unicode_literals: frozenset(('P001',)),
+}
+
+
+@contextlib.contextmanager
+def _memory_limit(max_memory: int | None) -> Generator[None, None, None]:
+    """Limits the address space of this process while compiling.  The limit
+    is lifted again afterwards so the flake8 subprocess does not inherit it.
+    """
+    if max_memory is None or sys.platform == 'win32':
+        yield
+    else:  # pragma: win32 no cover
+        soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, hard))
+        try:
+            yield
+        finally:
+            resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+
+
+MEMORY_LIMIT_EXCEEDED = (1, 'T007', 'Linting exceeded the memory limit')
+
+
+def _get_py_checks(
+        codes: frozenset[str] | None,
+) -> tuple[Callable[[Sequence[str]], tuple[LintCode, ...]], ...]:
+    return tuple(
+        check for check in PY_CHECKS
+        if codes is None or PY_CHECK_CODES[check] & codes
+    )
 
 
-def get_from_py(file_contents: str) -> tuple[LintCode, ...]:
+def _compile_py(
+        file_contents: str,
+        max_memory: int | None,
+        phase: Callable[[str], ContextManager[None]],
+        compile_cache: CompileCache | None,
+) -> tuple[str, SourceMap] | None:
+    """Returns None if compiling exceeded `max_memory`."""
+    try:
+        with phase('to_py'), _memory_limit(max_memory):
+            return _compile_cached(file_contents, compile_cache)
+    except MemoryError:
+        return None
+
+
+def _run_py_checks(
+        checks: Sequence[Callable[[Sequence[str]], tuple[LintCode, ...]]],
+        py_lines: Sequence[str],
+        fail_fast: bool,
+        phase: Callable[[str], ContextManager[None]],
+) -> tuple[LintCode, ...]:
+    """Returns the findings of `checks` with python line numbers, see
+    `_normalize_py`.
+    """
     data: tuple[LintCode, ...] = ()
-    cheetah_lines = file_contents.splitlines(True)
-    py_source = to_py(file_contents)
-    py_lines = py_source.splitlines(True)
-    for check in PY_CHECKS:
-        data += normalize_lines(check(py_lines), py_lines, cheetah_lines)
+    for check in checks:
+        if fail_fast and data:
+            break
+        with phase(check.__name__):
+            data += check(py_lines)
     return data
 
 
+def _needs_source_map(
+        data: Sequence[LintCode],
+        source_map: SourceMap | None,
+) -> bool:
+    """Whether the findings of a module without source map (a precompiled
+    one) need the template compiled for exact line numbers.
+    """
+    return source_map is None and any(
+        code in NEED_LINE_NUMBER_NORMALIZED for _, code, _ in data
+    )
+
+
+def _normalize_py(
+        data: Sequence[LintCode],
+        py_lines: Sequence[str],
+        file_contents: str,
+        source_map: SourceMap | None,
+        phase: Callable[[str], ContextManager[None]],
+) -> tuple[LintCode, ...]:
+    with phase('normalize_lines'):
+        return normalize_lines(
+            data, py_lines, file_contents.splitlines(True), source_map,
+        )
+
+
+def get_from_py(
+        file_contents: str,
+        max_memory: int | None = None,
+        codes: frozenset[str] | None = None,
+        phase: Callable[[str], ContextManager[None]] = no_phase,
+        py_source: str | None = None,
+        fail_fast: bool = False,
+        compile_cache: CompileCache | None = None,
+) -> tuple[LintCode, ...]:
+    checks = _get_py_checks(codes)
+    # Compiling is the expensive part, skip it if nothing would use it
+    if not checks:
+        return ()
+
+    source_map: SourceMap | None = None
+    if py_source is not None:
+        py_lines = py_source.splitlines(True)
+        data = _run_py_checks(checks, py_lines, fail_fast, phase)
+    if py_source is None or _needs_source_map(data, source_map):
+        compiled = _compile_py(file_contents, max_memory, phase, compile_cache)
+        if compiled is None:
+            return (MEMORY_LIMIT_EXCEEDED,)
+        py_source, source_map = compiled
+        py_lines = py_source.splitlines(True)
+        data = _run_py_checks(checks, py_lines, fail_fast, phase)
+    return _normalize_py(data, py_lines, file_contents, source_map, phase)
+
+
 def check_implements(
         cheetah_by_line_no: Sequence[str],
 ) -> tuple[LintCode, ...]:
@@ -399,38 +731,773 @@ LINE_CHECKS = (
     check_indentation,
     check_empty,
 )
+LINE_CHECK_CODES = {
+    check_implements: frozenset(('T001',)),
+    check_extends_cheetah_template: frozenset(('T002',)),
+    check_indentation: frozenset(('T003', 'T004')),
+    check_empty: frozenset(('T005',)),
+}
+
+# T006 / T007: the time / memory limits were exceeded
+ALL_CODES = frozenset((
+    *(code for codes in PY_CHECK_CODES.values() for code in codes),
+    *(code for codes in LINE_CHECK_CODES.values() for code in codes),
+    'T006', 'T007',
+))
+
+
+def _longest_prefix(code: str, prefixes: Sequence[str]) -> int:
+    return max(
+        (len(prefix) for prefix in prefixes if code.startswith(prefix)),
+        default=-1,
+    )
 
 
-def get_from_lines(file_contents: str) -> tuple[LintCode, ...]:
+def get_enabled_codes(
+        select: Sequence[str] = (),
+        ignore: Sequence[str] = (),
+) -> frozenset[str]:
+    """Resolve `--select` / `--ignore` prefixes in the style of flake8: the
+    longest matching prefix wins and selecting nothing selects everything.
+    """
+    return frozenset(
+        code for code in ALL_CODES
+        if (
+            (_longest_prefix(code, select) if select else 0) >
+            _longest_prefix(code, ignore)
+        )
+    )
+
+
+def _filter_codes(
+        data: Iterable[LintCode],
+        codes: frozenset[str] | None,
+) -> tuple[LintCode, ...]:
+    return tuple(
+        lint_code for lint_code in data
+        if codes is None or lint_code[1] in codes
+    )
+
+
+def get_from_lines(
+        file_contents: str,
+        codes: frozenset[str] | None = None,
+        phase: Callable[[str], ContextManager[None]] = no_phase,
+) -> tuple[LintCode, ...]:
     cheetah_by_line_no = ('',) + tuple(file_contents.splitlines(True))
     data: tuple[LintCode, ...] = ()
     for check in LINE_CHECKS:
-        data += check(cheetah_by_line_no)
+        if codes is None or LINE_CHECK_CODES[check] & codes:
+            with phase(check.__name__):
+                data += check(cheetah_by_line_no)
     return data
 
 
-def get_flakes(file_contents: str) -> tuple[LintCode, ...]:
-    data = (*get_from_py(file_contents), *get_from_lines(file_contents))
+def get_flakes(
+        file_contents: str,
+        max_memory: int | None = None,
+        codes: frozenset[str] | None = None,
+        phase: Callable[[str], ContextManager[None]] = no_phase,
+        py_source: str | None = None,
+        fail_fast: bool = False,
+        compile_cache: CompileCache | None = None,
+) -> tuple[LintCode, ...]:
+    """Lints a template.
+
+    With `fail_fast`, the checks stop at the first one with findings: the
+    cheap line checks run first and the expensive compilation and flake8
+    stages are skipped if they already found something.
+
+    With `compile_cache`, templates compiled before are not compiled again.
+
+    Linting keeps no state between calls, so templates may be linted
+    concurrently from several threads (only compiling is serialized, see
+    `compile_lock`), except with `max_memory` which limits the whole process
+    (see `get_flakes_limited`).
+    """
+    data = _filter_codes(get_from_lines(file_contents, codes, phase), codes)
+    if not (fail_fast and data):
+        data += _filter_codes(
+            get_from_py(
+                file_contents, max_memory, codes, phase, py_source, fail_fast,
+                compile_cache,
+            ),
+            codes,
+        )
     return tuple(sorted(data))
 
 
-def flake(filename: str) -> int:
-    file_contents = read_file(filename)
-    flakes = get_flakes(file_contents)
+def _limited_worker(  # pragma: no cover (runs in the worker process)
+        conn: multiprocessing.connection.Connection,
+        file_contents: str,
+        max_memory: int | None,
+        codes: frozenset[str] | None,
+        py_source: str | None,
+        fail_fast: bool,
+        compile_cache: CompileCache | None,
+) -> None:
+    if sys.platform != 'win32':  # pragma: win32 no cover
+        # so the flake8 subprocess can be killed along with this one
+        os.setpgrp()
+    try:
+        flakes = get_flakes(
+            file_contents, max_memory, codes,
+            py_source=py_source,
+            fail_fast=fail_fast,
+            compile_cache=compile_cache,
+        )
+    except BaseException as e:
+        conn.send(e)
+    else:
+        # stored by the parent, which keeps track of the cache's size
+        pending = [] if compile_cache is None else compile_cache.pending
+        conn.send((flakes, pending))
+
+
+def _kill_worker(proc: multiprocessing.Process) -> None:
+    if sys.platform != 'win32':  # pragma: win32 no cover
+        assert proc.pid is not None
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:  # it exited (or has no group yet)
+            pass
+    proc.kill()
+
+
+def get_flakes_limited(
+        file_contents: str,
+        timeout: float | None = None,
+        max_memory: int | None = None,
+        codes: frozenset[str] | None = None,
+        py_source: str | None = None,
+        fail_fast: bool = False,
+        compile_cache: CompileCache | None = None,
+) -> tuple[LintCode, ...]:
+    """Lints in a separate process which is killed if it runs over `timeout`
+    seconds so a single pathological template cannot stall the run.  The
+    process runs in its own process group, which is killed with it, so a
+    flake8 subprocess does not outlive it.  What it compiled is stored in
+    `compile_cache` here.
+    """
+    recv, send = multiprocessing.Pipe(duplex=False)
+    proc = multiprocessing.Process(
+        target=_limited_worker,
+        args=(
+            send, file_contents, max_memory, codes, py_source, fail_fast,
+            None if compile_cache is None else compile_cache.deferring(),
+        ),
+    )
+    proc.start()
+    send.close()
+    pending: list[tuple[str, Compiled]] = []
+    try:
+        if not recv.poll(timeout):
+            ret: tuple[LintCode, ...] | BaseException = (
+                (1, 'T006', f'Linting exceeded the time limit ({timeout}s)'),
+            )
+        else:
+            try:
+                received = recv.recv()
+            except EOFError:  # the worker died without reporting (oom killed)
+                ret = (MEMORY_LIMIT_EXCEEDED,)
+            else:
+                if isinstance(received, BaseException):
+                    ret = received
+                else:
+                    ret, pending = received
+    finally:
+        _kill_worker(proc)
+        proc.join()
+        recv.close()
+
+    if isinstance(ret, BaseException):
+        raise ret
+    else:
+        if compile_cache is not None:
+            for src, compiled in pending:
+                compile_cache.put(src, compiled)
+        return _filter_codes(ret, codes)
+
+
+def lint_file(
+        filename: str,
+        timeout: float | None = None,
+        max_memory: int | None = None,
+        codes: frozenset[str] | None = None,
+        phase: Callable[[str], ContextManager[None]] = no_phase,
+        precompiled_dir: str | None = None,
+        fail_fast: bool = False,
+        file_contents: str | None = None,
+        compile_cache: CompileCache | None = None,
+) -> tuple[LintCode, ...]:
+    """Lints the template `filename`.
+
+    :param text file_contents: Contents of the template if it was already
+        read.  For templates which are not files (from an archive or stdin)
+        `filename` is then only its name and `precompiled_dir` must be None.
+    """
+    if file_contents is None:
+        file_contents = read_file(filename)
+    if precompiled_dir is None:
+        py_source = None
+    else:
+        py_source = read_precompiled(filename, file_contents, precompiled_dir)
+    if timeout is None and max_memory is None:
+        return get_flakes(
+            file_contents,
+            codes=codes,
+            phase=phase,
+            py_source=py_source,
+            fail_fast=fail_fast,
+            compile_cache=compile_cache,
+        )
+    else:
+        return get_flakes_limited(
+            file_contents, timeout, max_memory, codes, py_source, fail_fast,
+            compile_cache,
+        )
+
+
+class Template(NamedTuple):
+    filename: str
+    # None until read from the file
+    file_contents: str | None
+    # whether it is a file (rather than from an archive or stdin)
+    is_file: bool
+    cache_key: str | None = None
+    cached: tuple[LintCode, ...] | None = None
+
+
+# Results which depend on more than the template are not cached
+UNCACHED_CODES = frozenset(('T006', 'T007'))
+CACHE_BATCH_SIZE = 100
+
+
+def get_cached(
+        templates: Iterable[Template],
+        cache: RemoteCache,
+        options: Sequence[str],
+        precompiled_dir: str | None = None,
+) -> Generator[Template, None, None]:
+    """Looks up the results of `templates` linted with `options` in the
+    cache, one request per `CACHE_BATCH_SIZE` templates.
+
+    With `precompiled_dir`, the results also depend on the module linted
+    instead of compiling the template (see `read_precompiled`).
+    """
+    it = iter(templates)
+    while True:
+        batch = []
+        keys = []
+        for template in itertools.islice(it, CACHE_BATCH_SIZE):
+            file_contents = template.file_contents
+            if file_contents is None:
+                file_contents = read_file(template.filename)
+            py_source = None
+            if precompiled_dir is not None and template.is_file:
+                py_source = read_precompiled(
+                    template.filename, file_contents, precompiled_dir,
+                )
+            if py_source is None:
+                precompiled = 'precompiled=None'
+            else:
+                h = hashlib.sha256(py_source.encode('UTF-8')).hexdigest()
+                precompiled = f'precompiled={h}'
+            key = cache_key(
+                file_contents,
+                (*options, f'is_file={template.is_file}', precompiled),
+            )
+            batch.append(
+                template._replace(file_contents=file_contents, cache_key=key),
+            )
+            keys.append(key)
+        if not batch:
+            return
+
+        hits = cache.get_many(keys)
+        for template, key in zip(batch, keys):
+            if key in hits:
+                cached = tuple(
+                    (line, code, msg) for line, code, msg in hits[key]
+                )
+                yield template._replace(cached=cached)
+            else:
+                yield template
+
+
+def skip_baselined(
+        templates: Iterable[Template],
+        baseline: Baseline,
+        codes: frozenset[str],
+) -> Generator[Template, None, None]:
+    """Reads `templates`, those whose findings are all in `baseline` because
+    they did not change since it was written are not linted (they have no
+    findings to report).
+    """
+    for template in templates:
+        file_contents = template.file_contents
+        if file_contents is None:
+            file_contents = read_file(template.filename)
+        template = template._replace(file_contents=file_contents)
+        if (
+                template.cached is None and
+                baseline.is_unchanged(template.filename, file_contents, codes)
+        ):
+            template = template._replace(cached=())
+        yield template
+
+
+class _InFlight(NamedTuple):
+    template: Template
+    # findings which need no normalizing
+    flakes: tuple[LintCode, ...] = ()
+    py_source: str | None = None
+    source_map: SourceMap | None = None
+    # findings in `py_source` to be normalized
+    py_flakes: tuple[LintCode, ...] = ()
+    # whether the remaining stages have nothing to do
+    done: bool = False
+
+
+PIPELINE_QUEUE_SIZE = 4
+
+
+def lint_pipelined(
+        templates: Iterable[Template],
+        codes: frozenset[str] | None = None,
+        precompiled_dir: str | None = None,
+        fail_fast: bool = False,
+        durations: dict[str, float] | None = None,
+        compile_cache: CompileCache | None = None,
+        phase: Callable[[str], ContextManager[None]] = no_phase,
+) -> Generator[tuple[Template, tuple[LintCode, ...]], None, None]:
+    """Lints `templates` like `lint_file`, but split into stages (reading,
+    line checks and compiling, the python checks, normalizing) which run in
+    their own threads.  While flake8 checks one template the next one is
+    compiled, so the waiting on the flake8 subprocess is not wasted.
+
+    Results are produced in the order of `templates`, templates with cached
+    results skip the stages.  With `durations`, the time spent on each
+    template (in all stages) is recorded in it.  `phase` is entered from the
+    stages' threads, so phases of different templates overlap.
+    """
+    checks = _get_py_checks(codes)
+
+    def _read(in_flight: _InFlight) -> _InFlight:
+        template = in_flight.template
+        if template.cached is not None:
+            return in_flight._replace(flakes=template.cached, done=True)
+        file_contents = template.file_contents
+        if file_contents is None:
+            file_contents = read_file(template.filename)
+        if precompiled_dir is None or not template.is_file:
+            py_source = None
+        else:
+            py_source = read_precompiled(
+                template.filename, file_contents, precompiled_dir,
+            )
+        return in_flight._replace(
+            template=template._replace(file_contents=file_contents),
+            py_source=py_source,
+        )
+
+    def _compile(in_flight: _InFlight) -> _InFlight:
+        assert in_flight.template.file_contents is not None
+        file_contents = in_flight.template.file_contents
+        flakes = _filter_codes(
+            get_from_lines(file_contents, codes, phase), codes,
+        )
+        if (fail_fast and flakes) or not checks:
+            return in_flight._replace(flakes=flakes, done=True)
+        elif in_flight.py_source is None:
+            return _compiled(in_flight._replace(flakes=flakes))
+        else:
+            return in_flight._replace(flakes=flakes)
+
+    def _compiled(in_flight: _InFlight) -> _InFlight:
+        assert in_flight.template.file_contents is not None
+        compiled = _compile_py(
+            in_flight.template.file_contents, None, phase, compile_cache,
+        )
+        if compiled is None:
+            return in_flight._replace(
+                flakes=in_flight.flakes + _filter_codes(
+                    (MEMORY_LIMIT_EXCEEDED,), codes,
+                ),
+                done=True,
+            )
+        py_source, source_map = compiled
+        return in_flight._replace(py_source=py_source, source_map=source_map)
+
+    def _check(in_flight: _InFlight) -> _InFlight:
+        assert in_flight.py_source is not None
+        py_lines = in_flight.py_source.splitlines(True)
+        py_flakes = _run_py_checks(checks, py_lines, fail_fast, phase)
+        if _needs_source_map(py_flakes, in_flight.source_map):
+            in_flight = _compiled(in_flight)
+            if in_flight.done:
+                return in_flight
+            return _check(in_flight)
+        return in_flight._replace(py_flakes=py_flakes)
+
+    def _normalize(in_flight: _InFlight) -> _InFlight:
+        assert in_flight.template.file_contents is not None
+        assert in_flight.py_source is not None
+        py_flakes = _normalize_py(
+            in_flight.py_flakes,
+            in_flight.py_source.splitlines(True),
+            in_flight.template.file_contents,
+            in_flight.source_map,
+            phase,
+        )
+        return in_flight._replace(
+            flakes=in_flight.flakes + _filter_codes(py_flakes, codes),
+        )
+
+    def _stage(
+            func: Callable[[_InFlight], _InFlight],
+    ) -> Callable[[_InFlight], _InFlight]:
+        def _run_stage(in_flight: _InFlight) -> _InFlight:
+            if in_flight.done:
+                return in_flight
+            start = time.monotonic()
+            try:
+                return func(in_flight)
+            finally:
+                if durations is not None:
+                    filename = in_flight.template.filename
+                    durations[filename] = (
+                        durations.get(filename, 0.) +
+                        time.monotonic() - start
+                    )
+        return _run_stage
+
+    results = pipeline(
+        (_InFlight(template) for template in templates),
+        tuple(_stage(func) for func in (_read, _compile, _check, _normalize)),
+        PIPELINE_QUEUE_SIZE,
+    )
+    with contextlib.closing(results):
+        for in_flight in results:
+            yield in_flight.template, tuple(sorted(in_flight.flakes))
+
+
+def print_flakes(filename: str, flakes: Sequence[LintCode]) -> None:
     for lineno, code, msg in flakes:
         print(f'{filename}:{lineno} {code} {msg}')
-    return int(bool(flakes))
+
+
+def _comma_separated(s: str) -> tuple[str, ...]:
+    return tuple(part.strip() for part in s.split(',') if part.strip())
 
 
 def main(argv: Sequence[str] | None = None) -> int:
     parser = argparse.ArgumentParser()
-    parser.add_argument('filenames', nargs='*', help='Filenames to flake.')
+    parser.add_argument(
+        'filenames', nargs='*',
+        help=(
+            'Filenames to flake.  Tar and zip archives are linted without '
+            'extracting them and `-` is read from stdin.'
+        ),
+    )
+    parser.add_argument(
+        '--stdin-filename', metavar='NAME',
+        help=(
+            'Name to report for `-` (default: stdin).  If it is named like '
+            'an archive, stdin is read as one.'
+        ),
+    )
+    parser.add_argument(
+        '--timeout', type=float, metavar='SECONDS',
+        help='Report T006 for files which take longer than this to lint.',
+    )
+    parser.add_argument(
+        '--max-memory', type=int, metavar='MB',
+        help=(
+            'Report T007 for files which need more than this much memory '
+            'to compile.'
+        ),
+    )
+    parser.add_argument(
+        '--select', type=_comma_separated, default=(), metavar='CODES',
+        help='Comma separated list of code prefixes to enable (default: all).',
+    )
+    parser.add_argument(
+        '--ignore', type=_comma_separated, default=(), metavar='CODES',
+        help='Comma separated list of code prefixes to disable.',
+    )
+    parser.add_argument(
+        '--memory-report', action='store_true',
+        help=(
+            'Print peak and retained memory (python allocations and the '
+            'resident set size) for each file and phase to stderr.'
+        ),
+    )
+    parser.add_argument(
+        '--precompiled', metavar='DIR',
+        help=(
+            'Directory of modules compiled by yelp-cheetah from the current '
+            'templates.  Modules newer than their template are linted '
+            'instead of compiling it again (only the modification times are '
+            'compared).'
+        ),
+    )
+    parser.add_argument(
+        '--watch', nargs='+', default=[], metavar='PATH',
+        help=(
+            'Lint templates in these files / directories and relint them '
+            'when they change, until interrupted.'
+        ),
+    )
+    parser.add_argument(
+        '--fail-fast', action='store_true',
+        help=(
+            'Stop at the first file with findings, skipping its remaining '
+            'checks once one of them has findings.'
+        ),
+    )
+    parser.add_argument(
+        '--count', action='store_true',
+        help='Only print the number of findings.',
+    )
+    parser.add_argument(
+        '--exit-zero', action='store_true',
+        help='Exit with status 0 even if there are findings.',
+    )
+    parser.add_argument(
+        '--cache-url', metavar='URL',
+        help=(
+            'Share results through the cache served at this url (see '
+            'cheetah-lint-cache-server), unchanged templates are not linted '
+            'again.'
+        ),
+    )
+    parser.add_argument(
+        '--compile-cache', metavar='DIR',
+        help=(
+            'Keep the compiled templates in this directory, unchanged '
+            'templates are not compiled again even if the checks change.'
+        ),
+    )
+    parser.add_argument(
+        '--compile-cache-size', type=positive_int, default=512, metavar='MB',
+        help=(
+            'Evict the least recently used compiled templates once the '
+            '--compile-cache is larger than this (default: 512).'
+        ),
+    )
+    parser.add_argument(
+        '--baseline', metavar='FILE',
+        help=(
+            'Do not report the findings recorded in this file (see '
+            '--write-baseline).  Files which did not change since are not '
+            'linted.'
+        ),
+    )
+    parser.add_argument(
+        '--write-baseline', action='store_true',
+        help='Record the findings in the --baseline file instead.',
+    )
+    parser.add_argument(
+        '--pipeline', action='store_true',
+        help=(
+            'Overlap reading, compiling, checking and normalizing different '
+            'files in threads.'
+        ),
+    )
+    add_jobs_argument(parser)
+    add_shard_arguments(parser)
     args = parser.parse_args(argv)
 
-    retv = 0
-    for filename in args.filenames:
-        retv |= flake(filename)
-    return retv
+    if args.memory_report and args.watch:
+        parser.error('--memory-report cannot be used with --watch')
+    if args.watch and any(
+            filename == '-' or is_archive(filename)
+            for filename in (*args.watch, *args.filenames)
+    ):
+        parser.error('--watch cannot be used with archives or stdin')
+    if args.shard is not None and any(
+            filename == '-' or is_archive(filename)
+            for filename in args.filenames
+    ):
+        # the shards are made of the paths given, an archive is one of them
+        parser.error('--shard cannot be used with archives or stdin')
+    if args.cache_url and args.watch:
+        parser.error('--cache-url cannot be used with --watch')
+    if args.memory_report and (
+            args.timeout is not None or args.max_memory is not None
+    ):
+        parser.error(
+            '--memory-report cannot be used with --timeout / --max-memory',
+        )
+    if args.memory_report and args.jobs > 1:
+        # tracemalloc measures the whole process, not just one file
+        parser.error('--memory-report cannot be used with --jobs')
+    if args.baseline is not None and args.precompiled is not None:
+        # the line numbers, so the fingerprints, depend on whether a module
+        # was used
+        parser.error('--baseline cannot be used with --precompiled')
+    if args.write_baseline and args.baseline is None:
+        parser.error('--write-baseline requires --baseline')
+    if args.baseline is not None and args.watch:
+        parser.error('--baseline cannot be used with --watch')
+    if args.write_baseline and (args.fail_fast or args.shard is not None):
+        # every file has to be recorded
+        parser.error(
+            '--write-baseline cannot be used with --fail-fast / --shard',
+        )
+    if args.pipeline and (
+            args.memory_report or
+            args.watch or
+            args.jobs > 1 or
+            args.timeout is not None or
+            args.max_memory is not None
+    ):
+        parser.error(
+            '--pipeline cannot be used with --memory-report / --watch / '
+            '--jobs / --timeout / --max-memory',
+        )
+
+    codes = get_enabled_codes(args.select, args.ignore)
+    if args.baseline is None:
+        baseline = None
+    elif args.write_baseline:
+        baseline = Baseline(codes, root=os.path.dirname(args.baseline))
+    else:
+        try:
+            baseline = Baseline.load(args.baseline)
+        except (OSError, ValueError) as e:
+            parser.error(f'--baseline: {e}')
+    if args.max_memory is None:
+        max_memory = None
+    else:
+        max_memory = args.max_memory * 1024 * 1024
+
+    if args.compile_cache is None:
+        compile_cache = None
+    else:
+        compile_cache = CompileCache(
+            args.compile_cache, args.compile_cache_size * 1024 * 1024,
+        )
+
+    lint = functools.partial(
+        lint_file,
+        timeout=args.timeout,
+        max_memory=max_memory,
+        codes=codes,
+        precompiled_dir=args.precompiled,
+        fail_fast=args.fail_fast,
+        compile_cache=compile_cache,
+    )
+
+    if args.watch:
+        def _flake(filename: str) -> None:
+            print_flakes(filename, lint(filename))
+
+        return watch([*args.watch, *args.filenames], _flake)
+
+    try:
+        filenames = select_files(
+            args.filenames, args.shard, args.durations, args.jobs,
+        )
+    except (OSError, ValueError) as e:
+        parser.error(f'--durations: {e}')
+    durations: dict[str, float] = {}
+    count = 0
+    with contextlib.ExitStack() as ctx:
+        phase: Callable[[str], ContextManager[None]]
+        if args.memory_report:
+            report = ctx.enter_context(MemoryReport())
+            phase = report.phase
+        else:
+            phase = no_phase
+
+        def _lint(
+                template: Template,
+        ) -> tuple[Template, tuple[LintCode, ...]]:
+            filename = template.filename
+            if template.cached is not None:
+                return template, template.cached
+            with contextlib.ExitStack() as file_ctx:
+                file_ctx.enter_context(record_duration(durations, filename))
+                if args.memory_report:
+                    file_ctx.enter_context(report.file(filename))
+                flakes = lint(
+                    filename,
+                    phase=phase,
+                    precompiled_dir=(
+                        args.precompiled if template.is_file else None
+                    ),
+                    file_contents=template.file_contents,
+                )
+            return template, flakes
+
+        def _store(template: Template, flakes: tuple[LintCode, ...]) -> None:
+            if (
+                    template.cache_key is not None and
+                    template.cached is None and
+                    not any(code in UNCACHED_CODES for _, code, _ in flakes)
+            ):
+                cache.put(template.cache_key, [list(f) for f in flakes])
+
+        templates: Iterable[Template] = (
+            Template(filename, file_contents, file_contents is None)
+            for filename, file_contents in iter_inputs(
+                filenames, args.stdin_filename,
+            )
+        )
+        if args.cache_url is not None:
+            cache = ctx.enter_context(RemoteCache(args.cache_url))
+            options = (
+                f'codes={",".join(sorted(codes))}',
+                f'fail_fast={args.fail_fast}',
+            )
+            templates = get_cached(
+                templates, cache, options, args.precompiled,
+            )
+        if baseline is not None:
+            templates = skip_baselined(templates, baseline, codes)
+        results: Generator[tuple[Template, tuple[LintCode, ...]], None, None]
+        if args.pipeline:
+            results = lint_pipelined(
+                templates,
+                codes=codes,
+                precompiled_dir=args.precompiled,
+                fail_fast=args.fail_fast,
+                durations=durations,
+                compile_cache=compile_cache,
+            )
+        else:
+            results = map_in_order(_lint, templates, args.jobs)
+        ctx.enter_context(contextlib.closing(results))
+        for template, flakes in results:
+            _store(template, flakes)
+            if baseline is not None:
+                assert template.file_contents is not None
+                if args.write_baseline:
+                    baseline.record(
+                        template.filename, template.file_contents, flakes,
+                    )
+                    continue
+                flakes = baseline.filter(
+                    template.filename, template.file_contents, flakes,
+                )
+            count += len(flakes)
+            if not args.count:
+                print_flakes(template.filename, flakes)
+            if args.fail_fast and flakes:
+                break
+
+    if args.memory_report:
+        print(report.format(), file=sys.stderr)
+    if args.durations is not None and durations:
+        save_durations(args.durations, durations)
+    if args.write_baseline:
+        assert baseline is not None
+        baseline.save(args.baseline)
+    if args.count:
+        print(count)
+    return 0 if args.exit_zero else int(bool(count))
 
 
 if __name__ == '__main__':
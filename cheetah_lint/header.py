@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import re
+
+# Only the simplest forms of the directives are recognized, anything else
+# ends the header (and will then force a full parse, see below).
+HEADER_RE = re.compile(
+    r'(?:'
+    r'\n|'
+    r'#(?:import|from|extends|implements) [^#$\r\n]*\n|'
+    r'#compiler-settings\n[^#$\r]*#end compiler-settings\n'
+    r')*',
+)
+# A directive may continue on the next line inside brackets or after a
+# backslash, the header would then end in the middle of it
+CONTINUATION_RE = re.compile(r'[([{]|\\$', re.MULTILINE)
+# Anything resembling a directive which the import reordering moves
+BODY_DIRECTIVE_RE = re.compile(
+    r'#(?:import|from|extends|implements|compiler-settings)\b',
+)
+
+
+def split_header(file_contents: str) -> tuple[str, str] | None:
+    """Splits a template into the leading directives which the import
+    reordering rewrites and the body which it leaves alone.
+
+    Returns None if the body may contain anything the reordering would touch,
+    in which case the whole template must be parsed.
+    """
+    match = HEADER_RE.match(file_contents)
+    assert match is not None
+    header = match[0]
+    # Trailing blank lines belong to the body
+    if header.strip():
+        header = header[:len(header.rstrip('\n')) + 1]
+    else:
+        header = ''
+    body = file_contents[len(header):]
+
+    if CONTINUATION_RE.search(header) or BODY_DIRECTIVE_RE.search(body):
+        return None
+    else:
+        return header, body
+
+
+def join_header(header: str, body: str) -> str:
+    """Joins a header rewritten by the reordering steps back onto the body,
+    normalizing whitespace in the same way `fix_whitespace_after_imports`
+    does for the whole template.
+    """
+    body = body.lstrip('\n')
+    if body:
+        return header.rstrip('\n') + '\n\n\n' + body.rstrip('\n') + '\n'
+    else:
+        return header.rstrip('\n') + '\n'
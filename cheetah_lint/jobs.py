@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import argparse
+import collections
+import concurrent.futures
+import queue
+import threading
+from typing import Any
+from typing import Callable
+from typing import Generator
+from typing import Iterable
+from typing import NamedTuple
+from typing import Sequence
+from typing import TypeVar
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+def positive_int(s: str) -> int:
+    try:
+        ret = int(s)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'expected an integer, got {s!r}')
+    if ret < 1:
+        raise argparse.ArgumentTypeError(f'expected at least 1, got {s!r}')
+    return ret
+
+
+def add_jobs_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        '--jobs', '-j', type=positive_int, default=1, metavar='N',
+        help='Process this many files at a time in threads (default: 1).',
+    )
+
+
+def map_in_order(
+        func: Callable[[T], R],
+        items: Iterable[T],
+        jobs: int = 1,
+) -> Generator[R, None, None]:
+    """Like `map`, but calls `func` in `jobs` threads.  Results are produced
+    in the order of `items` regardless of the order they complete in.
+
+    `items` are consumed as the threads need them, at most `2 * jobs` ahead
+    of the results.  Closing the generator early cancels the calls which
+    have not started.
+    """
+    if jobs == 1:
+        yield from map(func, items)
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+        futures: collections.deque[concurrent.futures.Future[R]]
+        futures = collections.deque()
+        try:
+            for item in items:
+                futures.append(executor.submit(func, item))
+                if len(futures) >= 2 * jobs:
+                    yield futures.popleft().result()
+            while futures:
+                yield futures.popleft().result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+class _Failed(NamedTuple):
+    exc: BaseException
+
+
+_DONE = object()
+
+
+def pipeline(
+        items: Iterable[Any],
+        stages: Sequence[Callable[[Any], Any]],
+        maxsize: int = 4,
+) -> Generator[Any, None, None]:
+    """Passes each of `items` through `stages` in turn, each stage running
+    in its own thread so different items are in different stages at the
+    same time.  Results are produced in the order of `items`.
+
+    The stages are connected by queues of `maxsize` items, so a slow stage
+    holds up the ones before it rather than letting items pile up.  An
+    exception (also from iterating `items`) is raised when its item's
+    result is reached.  Closing the generator early stops the stages.
+    """
+    stop = threading.Event()
+    queues: list[queue.Queue[Any]] = [
+        queue.Queue(maxsize) for _ in stages
+    ]
+
+    def _put(q: queue.Queue[Any], item: object) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=.1)
+            except queue.Full:
+                continue
+            else:
+                return True
+        return False
+
+    def _get(q: queue.Queue[Any]) -> Generator[Any, None, None]:
+        while not stop.is_set():
+            try:
+                item = q.get(timeout=.1)
+            except queue.Empty:
+                continue
+            if item is _DONE:
+                return
+            yield item
+
+    def _items() -> Generator[Any, None, None]:
+        try:
+            yield from items
+        except Exception as e:
+            yield _Failed(e)
+
+    def _run(
+            func: Callable[[Any], Any],
+            inputs: Iterable[Any],
+            outputs: queue.Queue[Any],
+    ) -> None:
+        for item in inputs:
+            if not isinstance(item, _Failed):
+                try:
+                    item = func(item)
+                except Exception as e:
+                    item = _Failed(e)
+            if not _put(outputs, item):
+                return
+        _put(outputs, _DONE)
+
+    threads = [
+        threading.Thread(
+            target=_run,
+            args=(func, _items() if i == 0 else _get(queues[i - 1]), q),
+        )
+        for i, (func, q) in enumerate(zip(stages, queues))
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        for item in _get(queues[-1]):
+            if isinstance(item, _Failed):
+                raise item.exc
+            yield item
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
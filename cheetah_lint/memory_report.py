@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import contextlib
+import os
+import sys
+import tracemalloc
+from typing import ContextManager
+from typing import Generator
+from typing import NamedTuple
+
+if sys.platform != 'win32':  # pragma: win32 no cover
+    import resource
+
+STATM = '/proc/self/statm'
+
+
+class PhaseMemory(NamedTuple):
+    filename: str
+    phase: str
+    # None when it cannot be measured (python 3.8 has no `reset_peak`)
+    peak: int | None
+    retained: int
+    # growth of the resident set size, None when it cannot be read
+    rss: int | None = None
+
+
+class FileMemory(NamedTuple):
+    filename: str
+    retained: int
+    # resident set size after processing, relative to the start
+    rss: int | None = None
+
+
+def no_phase(phase: str) -> ContextManager[None]:
+    return contextlib.nullcontext()
+
+
+def format_size(size: int) -> str:
+    for unit in ('B', 'KiB', 'MiB'):
+        if abs(size) < 1024:
+            break
+        size //= 1024
+    else:
+        unit = 'GiB'
+    return f'{size}{unit}'
+
+
+def get_rss() -> int | None:
+    """The resident set size of this process.  Where it cannot be read from
+    `/proc` this is the largest it has been.
+    """
+    try:
+        with open(STATM) as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        if sys.platform == 'win32':  # pragma: win32 cover
+            return None
+        else:  # pragma: win32 no cover
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # in bytes on macos, in kilobytes elsewhere
+            return max_rss if sys.platform == 'darwin' else max_rss * 1024
+    else:
+        return pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def _difference(after: int | None, before: int | None) -> int | None:
+    if after is None or before is None:
+        return None
+    else:
+        return after - before
+
+
+class MemoryReport:
+    """Records peak and retained python allocations (via tracemalloc) and the
+    growth of the resident set size for each phase of processing each file.
+
+    tracemalloc does not trace allocations made in C (such as libxml2's
+    memory for lxml documents), only the resident set size includes them.
+    Allocations made by the flake8 subprocess are not included.  Peaks need
+    python 3.9+, before that only retained allocations are recorded.
+    """
+
+    def __init__(self) -> None:
+        self.phases: list[PhaseMemory] = []
+        self.files: list[FileMemory] = []
+        self._filename = ''
+        self._baseline = 0
+        self._baseline_rss: int | None = None
+
+    def __enter__(self) -> MemoryReport:
+        tracemalloc.start()
+        self._baseline, _ = tracemalloc.get_traced_memory()
+        self._baseline_rss = get_rss()
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        tracemalloc.stop()
+
+    @contextlib.contextmanager
+    def file(self, filename: str) -> Generator[None, None, None]:
+        self._filename = filename
+        try:
+            yield
+        finally:
+            current, _ = tracemalloc.get_traced_memory()
+            self.files.append(
+                FileMemory(
+                    filename,
+                    current - self._baseline,
+                    _difference(get_rss(), self._baseline_rss),
+                ),
+            )
+
+    @contextlib.contextmanager
+    def phase(self, phase: str) -> Generator[None, None, None]:
+        if sys.version_info >= (3, 9):  # pragma: >=3.9 cover
+            tracemalloc.reset_peak()
+            has_peak = True
+        else:  # pragma: <3.9 cover
+            has_peak = False
+        before, _ = tracemalloc.get_traced_memory()
+        before_rss = get_rss()
+        try:
+            yield
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            self.phases.append(
+                PhaseMemory(
+                    self._filename,
+                    phase,
+                    peak - before if has_peak else None,
+                    current - before,
+                    _difference(get_rss(), before_rss),
+                ),
+            )
+
+    def format(self, top: int = 10) -> str:
+        def _rss(rss: int | None) -> str:
+            return '' if rss is None else f', rss {format_size(rss)}'
+
+        if any(p.peak is None for p in self.phases):
+            lines = [
+                'Peak memory per phase is unavailable (needs python 3.9+).',
+                f'Top {top} phases by memory retained:',
+            ]
+            by_retained_phase = sorted(
+                self.phases, key=lambda p: p.retained, reverse=True,
+            )
+            for filename, phase, _, retained, rss in by_retained_phase[:top]:
+                lines.append(
+                    f'  {filename} {phase}: retained {format_size(retained)}'
+                    f'{_rss(rss)}',
+                )
+        else:
+            lines = [f'Top {top} phases by peak memory:']
+            by_peak = sorted(
+                self.phases, key=lambda p: p.peak or 0, reverse=True,
+            )
+            for filename, phase, peak, retained, rss in by_peak[:top]:
+                assert peak is not None
+                lines.append(
+                    f'  {filename} {phase}: peak {format_size(peak)}, '
+                    f'retained {format_size(retained)}{_rss(rss)}',
+                )
+
+        has_rss = (
+            bool(self.files) and
+            all(p.rss is not None for p in self.phases) and
+            all(f.rss is not None for f in self.files)
+        )
+        if has_rss:
+            lines.append(f'Top {top} phases by resident set size growth:')
+            by_rss = sorted(
+                self.phases, key=lambda p: p.rss or 0, reverse=True,
+            )
+            for filename, phase, _, _, rss in by_rss[:top]:
+                assert rss is not None
+                lines.append(f'  {filename} {phase}: {format_size(rss)}')
+
+        lines.append(f'Top {top} files by memory retained after processing:')
+        by_retained = sorted(
+            self.files,
+            key=lambda f: (f.rss or 0) if has_rss else f.retained,
+            reverse=True,
+        )
+        for filename, retained, rss in by_retained[:top]:
+            lines.append(f'  {filename}: {format_size(retained)}{_rss(rss)}')
+
+        if self.files:
+            # The first file pays for one-time costs (imports, caches), so
+            # use it as the baseline for the remaining files.  The resident
+            # set size also includes what tracemalloc does not see.
+            if has_rss:
+                first, last = self.files[0].rss, self.files[-1].rss
+                assert first is not None and last is not None
+                growth = last - first
+                measure = 'resident set size'
+            else:
+                growth = self.files[-1].retained - self.files[0].retained
+                measure = 'python allocations'
+            if growth <= 0:
+                lines.append(
+                    f'Memory returns to baseline between files '
+                    f'({measure}).',
+                )
+            else:
+                lines.append(
+                    f'Memory does not return to baseline between files: '
+                    f'{measure} grew {format_size(growth)} after the first '
+                    f'file.',
+                )
+        return '\n'.join(lines)
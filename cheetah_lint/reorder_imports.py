@@ -1,7 +1,10 @@
 from __future__ import annotations
 
 import argparse
+import difflib
+import sys
 from typing import Callable
+from typing import ContextManager
 from typing import Sequence
 
 import lxml.etree
@@ -12,10 +15,22 @@ from refactorlib.cheetah.parse import parse
 from refactorlib.node import ExactlyOneError
 
 from cheetah_lint.directives import get_all_imports
+from cheetah_lint.directives import get_all_imports_in_order
 from cheetah_lint.directives import get_compiler_settings_directive
 from cheetah_lint.directives import get_extends_directive
 from cheetah_lint.directives import get_implements_directive
+from cheetah_lint.header import join_header
+from cheetah_lint.header import split_header
 from cheetah_lint.imports import combine_import_objs
+from cheetah_lint.jobs import add_jobs_argument
+from cheetah_lint.jobs import map_in_order
+from cheetah_lint.memory_report import MemoryReport
+from cheetah_lint.memory_report import no_phase
+from cheetah_lint.shard import add_shard_arguments
+from cheetah_lint.shard import record_duration
+from cheetah_lint.shard import save_durations
+from cheetah_lint.shard import select_files
+from cheetah_lint.util import compile_lock
 from cheetah_lint.util import read_file
 
 
@@ -76,23 +91,24 @@ def apply_import_ordering(xmldoc: lxml.etree.Element) -> str:
     return xmldoc.totext(encoding='unicode')
 
 
+# The directives which `apply_import_ordering` moves to the top
+DIRECTIVES_XPATH = """
+    //cheetah/*[
+        self::compiler-settings or
+        self::Directive and (
+            starts-with(., "#extends") or
+            starts-with(., "#implements") or
+            SimpleExprDirective/UnbracedExpression/Py[1][
+                text() = 'from' or text() = 'import'
+            ]
+        )
+    ]
+"""
+
+
 def fix_whitespace_after_imports(xmldoc: lxml.etree.Element) -> str:
     try:
-        last_directive = xmldoc.xpath_one(
-            """(
-                //cheetah/*[
-                    self::compiler-settings or
-                    self::Directive and (
-                        starts-with(., "#extends") or
-                        starts-with(., "#implements") or
-                        SimpleExprDirective/UnbracedExpression/Py[1][
-                            text() = 'from' or text() = 'import'
-                        ]
-                    )
-                ]
-            )[last()]
-            """,
-        )
+        last_directive = xmldoc.xpath_one(f'({DIRECTIVES_XPATH})[last()]')
         following_whitespace_element = last_directive.xpath_one(
             'following-sibling::*[1]',
         )
@@ -109,16 +125,20 @@ def fix_whitespace_after_imports(xmldoc: lxml.etree.Element) -> str:
 def perform_step(
         file_contents: str,
         step: Callable[[lxml.etree.Element], str],
+        phase: Callable[[str], ContextManager[None]] = no_phase,
 ) -> str:
     """Performs a step of the transformation.
 
     :param text file_contents: Contends of the cheetah template
     :param function step: Function taking xmldoc and returning new contents
+    :param function phase: Context manager factory wrapping each phase
     :returns: new contents of the file.
     """
     assert type(file_contents) is not bytes
-    xmldoc = parse(file_contents)
-    return step(xmldoc)
+    with phase('parse'), compile_lock:
+        xmldoc = parse(file_contents)
+    with phase(step.__name__):
+        return step(xmldoc)
 
 
 STEPS = [
@@ -129,24 +149,231 @@ STEPS = [
 ]
 
 
+def apply_steps(
+        file_contents: str,
+        phase: Callable[[str], ContextManager[None]] = no_phase,
+) -> str:
+    """Performs all of the `STEPS`.
+
+    When possible only the leading directives are parsed and rewritten, so
+    the cost does not depend on the size of the rest of the template.
+
+    Each call parses its own documents, so templates may be processed
+    concurrently from several threads (only parsing is serialized, see
+    `compile_lock`).
+    """
+    split = split_header(file_contents)
+    if split is None:
+        for step in STEPS:
+            file_contents = perform_step(file_contents, step, phase)
+        return file_contents
+
+    header, body = split
+    if not header:
+        return file_contents
+    for step in STEPS:
+        header = perform_step(header, step, phase)
+    return join_header(header, body)
+
+
+def _apply_ordered_steps(
+        xmldoc: lxml.etree.Element,
+        sorted_blocks: Sequence[Sequence[Import | ImportFrom]],
+) -> str | None:
+    """Returns what the `STEPS` make of a document whose imports are already
+    split, deduplicated and sorted (into `sorted_blocks`), without running
+    them: only the placement of the directives and the whitespace after
+    them can still change.  Modifies `xmldoc`.
+
+    Returns None if the directives are too unusual to tell (another
+    `#extends` or `#implements` further down).
+    """
+    initial_block = [
+        directive for directive in (
+            get_compiler_settings_directive(xmldoc),
+            get_extends_directive(xmldoc),
+            get_implements_directive(xmldoc),
+        )
+        if directive is not None
+    ]
+    imports_text = '\n'.join(
+        combine_import_objs(block) for block in sorted_blocks
+    )
+    # like `apply_import_ordering`, followed by `fix_whitespace_after_imports`
+    # which separates the directives from the rest by two blank lines
+    directives = ''.join(
+        directive.totext(encoding='unicode') for directive in initial_block
+    )
+    if directives and imports_text:
+        directives += '\n' + imports_text
+        rest = ''
+    elif directives:
+        rest = '\n'
+    else:
+        directives = imports_text
+        rest = ''
+
+    for directive in initial_block:
+        directive.remove_self()
+    for cheetah_import in get_all_imports(xmldoc):
+        cheetah_import.directive_element.remove_self()
+    if xmldoc.xpath(DIRECTIVES_XPATH):
+        return None
+    rest += xmldoc.totext(encoding='unicode')
+
+    if not directives or not rest:
+        return directives + rest
+    else:
+        return (
+            directives + '\n\n' + rest.lstrip('\n')
+        ).rstrip('\n') + '\n'
+
+
+def needs_reordering(file_contents: str) -> bool:
+    """Returns whether `apply_steps` would change the template.
+
+    The imports are compared directly against their split, deduplicated and
+    sorted order, returning at the first violation.  When they are in order,
+    the placement of the directives and the whitespace after them are
+    checked on the same document.
+    """
+    split = split_header(file_contents)
+    if split is None:
+        contents = file_contents
+    elif split[0]:
+        contents = split[0]
+    else:
+        return False
+    with compile_lock:
+        xmldoc = parse(contents)
+
+    import_objs = []
+    seen: set[Import | ImportFrom] = set()
+    for cheetah_import in get_all_imports_in_order(xmldoc):
+        import_obj = cheetah_import.import_obj
+        if import_obj.is_multiple or import_obj in seen:
+            return True
+        seen.add(import_obj)
+        import_objs.append(import_obj)
+
+    sorted_blocks = sort(import_objs)
+    sorted_objs = (obj for block in sorted_blocks for obj in block)
+    if any(a != b for a, b in zip(import_objs, sorted_objs)):
+        return True
+
+    new_contents = _apply_ordered_steps(xmldoc, sorted_blocks)
+    if new_contents is None:
+        new_contents = apply_steps(file_contents)
+    elif split is not None:
+        new_contents = join_header(new_contents, split[1])
+    return new_contents != file_contents
+
+
+def get_reordering(
+        filename: str,
+        phase: Callable[[str], ContextManager[None]] = no_phase,
+        check: bool = False,
+        diff: bool = False,
+) -> tuple[int, str]:
+    """Reorders the imports of a template (see `reorder_imports`), returning
+    the output instead of printing it so files can be processed in threads.
+    """
+    original_contents = read_file(filename)
+    if check and not diff:
+        if needs_reordering(original_contents):
+            return 1, f'Imports need reordering in {filename}\n'
+        else:
+            return 0, ''
+
+    file_contents = apply_steps(original_contents, phase)
+    if file_contents == original_contents:
+        return 0, ''
+    elif diff:
+        return 1, ''.join(
+            difflib.unified_diff(
+                original_contents.splitlines(True),
+                file_contents.splitlines(True),
+                fromfile=filename,
+                tofile=filename,
+            ),
+        )
+    else:
+        with open(filename, 'w') as file_obj:
+            file_obj.write(file_contents)
+        return 1, f'Reordered imports in {filename}\n'
+
+
+def reorder_imports(
+        filename: str,
+        phase: Callable[[str], ContextManager[None]] = no_phase,
+        check: bool = False,
+        diff: bool = False,
+) -> int:
+    """Reorders the imports of a template.
+
+    :param bool check: Only report whether the imports need reordering.
+    :param bool diff: Print the changes instead of writing them.
+    """
+    retv, output = get_reordering(filename, phase, check, diff)
+    sys.stdout.write(output)
+    return retv
+
+
 def main(argv: Sequence[str] | None = None) -> int:
     parser = argparse.ArgumentParser()
     parser.add_argument('filenames', nargs='*')
+    parser.add_argument(
+        '--memory-report', action='store_true',
+        help=(
+            'Print peak and retained memory (python allocations and the '
+            'resident set size) for each file and phase to stderr.'
+        ),
+    )
+    parser.add_argument(
+        '--check', action='store_true',
+        help='Only check whether imports need reordering, do not write.',
+    )
+    parser.add_argument(
+        '--diff', action='store_true',
+        help='Print a diff of the reordering instead of writing it.',
+    )
+    add_jobs_argument(parser)
+    add_shard_arguments(parser)
     args = parser.parse_args(argv)
 
-    retv = 0
-    for filename in args.filenames:
-        original_contents = file_contents = read_file(filename)
-
-        for step in STEPS:
-            file_contents = perform_step(file_contents, step)
-
-        if file_contents != original_contents:
-            retv = 1
-            print(f'Reordered imports in {filename}')
-            with open(filename, 'w') as file_obj:
-                file_obj.write(file_contents)
+    if args.memory_report and args.jobs > 1:
+        # tracemalloc measures the whole process, not just one file
+        parser.error('--memory-report cannot be used with --jobs')
 
+    try:
+        filenames = select_files(
+            args.filenames, args.shard, args.durations, args.jobs,
+        )
+    except (OSError, ValueError) as e:
+        parser.error(f'--durations: {e}')
+    durations: dict[str, float] = {}
+    retv = 0
+    if args.memory_report:
+        with MemoryReport() as report:
+            for filename in filenames:
+                with report.file(filename):
+                    retv |= reorder_imports(
+                        filename, report.phase, args.check, args.diff,
+                    )
+        print(report.format(), file=sys.stderr)
+    else:
+        def _get_reordering(filename: str) -> tuple[int, str]:
+            with record_duration(durations, filename):
+                return get_reordering(
+                    filename, check=args.check, diff=args.diff,
+                )
+
+        for ret, output in map_in_order(_get_reordering, filenames, args.jobs):
+            retv |= ret
+            sys.stdout.write(output)
+
+    if args.durations is not None and durations:
+        save_durations(args.durations, durations)
     return retv
 
 
@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import argparse
+import contextlib
+import json
+import os
+import time
+from typing import Generator
+from typing import Sequence
+
+
+def parse_shard(s: str) -> tuple[int, int]:
+    """Parses `I/N` (the I-th of N shards, counting from 1)."""
+    try:
+        index_s, count_s = s.split('/')
+        index, count = int(index_s), int(count_s)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'expected I/N, got {s!r}')
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f'expected 1 <= I <= N, got {s!r}')
+    return index, count
+
+
+def load_durations(filename: str | None) -> dict[str, float]:
+    if filename is None:
+        return {}
+    try:
+        with open(filename) as f:
+            durations = json.load(f)
+    except FileNotFoundError:
+        return {}
+    if not isinstance(durations, dict) or not all(
+            type(duration) in (int, float) for duration in durations.values()
+    ):
+        raise ValueError(f'{filename}: invalid durations')
+    return durations
+
+
+def save_durations(filename: str, durations: dict[str, float]) -> None:
+    """Merges `durations` into those previously recorded in `filename`."""
+    contents = {**load_durations(filename), **durations}
+    with open(filename, 'w') as f:
+        json.dump(contents, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+@contextlib.contextmanager
+def record_duration(
+        durations: dict[str, float],
+        filename: str,
+) -> Generator[None, None, None]:
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        durations[filename] = time.monotonic() - start
+
+
+def _size(filename: str) -> int:
+    # every file costs something, even when empty
+    try:
+        return max(os.path.getsize(filename), 1)
+    except OSError:
+        return 1
+
+
+def get_costs(
+        filenames: Sequence[str],
+        durations: dict[str, float],
+) -> dict[str, float]:
+    """Estimates the cost of each file: its recorded duration if there is one,
+    otherwise its size scaled by the time per byte of the recorded files.
+    """
+    sizes = {filename: _size(filename) for filename in filenames}
+    timed = [filename for filename in filenames if filename in durations]
+    timed_size = sum(sizes[filename] for filename in timed)
+    if timed_size:
+        per_byte = sum(durations[filename] for filename in timed) / timed_size
+    else:
+        per_byte = 1.
+    return {
+        filename: durations.get(filename, sizes[filename] * per_byte)
+        for filename in filenames
+    }
+
+
+def order_by_cost(
+        filenames: Sequence[str],
+        costs: dict[str, float],
+) -> list[str]:
+    """Most expensive first so the slowest files do not finish last."""
+    return sorted(set(filenames), key=lambda f: (-costs[f], f))
+
+
+def get_shard(
+        filenames: Sequence[str],
+        index: int,
+        count: int,
+        costs: dict[str, float],
+) -> list[str]:
+    """Deterministically partitions `filenames` into `count` shards of about
+    equal cost (assigning the most expensive files first, each to the least
+    loaded shard) and returns the `index`-th (from 1) in cost order.
+    """
+    loads = [0.] * count
+    shards: list[list[str]] = [[] for _ in range(count)]
+    for filename in order_by_cost(filenames, costs):
+        _, i = min((load, i) for i, load in enumerate(loads))
+        loads[i] += costs[filename]
+        shards[i].append(filename)
+    return shards[index - 1]
+
+
+def add_shard_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        '--shard', type=parse_shard, metavar='I/N',
+        help=(
+            'Only process the I-th of N shards of about equal cost, most '
+            'expensive files first.'
+        ),
+    )
+    parser.add_argument(
+        '--durations', metavar='FILE',
+        help=(
+            'Record how long each file took in this json file.  With '
+            '--shard, --jobs or --durations the most expensive files are '
+            'processed first, by their recorded duration (otherwise by '
+            'their size).'
+        ),
+    )
+
+
+def select_files(
+        filenames: Sequence[str],
+        shard: tuple[int, int] | None,
+        durations_file: str | None,
+        jobs: int = 1,
+) -> list[str]:
+    """Returns the files of `shard` (all of them without one), ordered by
+    cost when there is a cost model or several jobs work through them.
+
+    Raises `ValueError` for an invalid `durations_file`.
+    """
+    if shard is None and durations_file is None and jobs == 1:
+        return list(filenames)
+    costs = get_costs(filenames, load_durations(durations_file))
+    if shard is None:
+        return order_by_cost(filenames, costs)
+    else:
+        return get_shard(filenames, *shard, costs)
@@ -1,5 +1,21 @@
 from __future__ import annotations
 
+import contextlib
+import sys
+import threading
+from typing import ContextManager
+
+# Held while yelp-cheetah compiles (which `refactorlib` parsing does too).
+# Compiling is pure python so under the GIL threads gain nothing by doing it
+# concurrently, and some versions of CPython share the state of `ast.parse`
+# between threads, failing with "AST constructor recursion depth mismatch"
+# (python/cpython#106905).
+compile_lock: ContextManager[object]
+if getattr(sys, '_is_gil_enabled', lambda: True)():
+    compile_lock = threading.Lock()
+else:  # pragma: no cover (free-threaded)
+    compile_lock = contextlib.nullcontext()
+
 
 def read_file(filename: str) -> str:
     with open(filename) as f:
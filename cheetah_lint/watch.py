@@ -0,0 +1,234 @@
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from typing import Callable
+from typing import Sequence
+
+TEMPLATE_EXTENSION = '.tmpl'
+
+# from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+def find_templates(paths: Sequence[str]) -> list[str]:
+    """Expands directories in `paths` to the templates they contain."""
+    ret: list[str] = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, _, filenames in os.walk(path):
+                ret.extend(
+                    os.path.join(dirpath, filename)
+                    for filename in sorted(filenames)
+                    if filename.endswith(TEMPLATE_EXTENSION)
+                )
+        else:
+            ret.append(path)
+    return ret
+
+
+class PollingWatcher:
+    """Finds changed templates by comparing `stat` results periodically."""
+
+    def __init__(self, paths: Sequence[str], interval: float = .25) -> None:
+        self.paths = paths
+        self.interval = interval
+        self._stats = self._snapshot()
+
+    def _snapshot(self) -> dict[str, tuple[int, int]]:
+        ret = {}
+        for filename in find_templates(self.paths):
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            ret[filename] = (st.st_mtime_ns, st.st_size)
+        return ret
+
+    def _changed(self) -> set[str]:
+        stats = self._snapshot()
+        ret = {
+            filename for filename, stat in stats.items()
+            if self._stats.get(filename) != stat
+        }
+        self._stats = stats
+        return ret
+
+    def wait(
+            self,
+            timeout: float | None = None,
+            delay: float = .05,
+    ) -> set[str]:
+        """Block until templates change and return them.  Changes which
+        happen within `delay` seconds of each other are returned together.
+
+        An empty set is returned if nothing changed within `timeout` seconds.
+        """
+        end = None if timeout is None else time.monotonic() + timeout
+        changed = self._changed()
+        while not changed:
+            if end is not None and time.monotonic() >= end:
+                return set()
+            time.sleep(self.interval)
+            changed = self._changed()
+
+        while True:
+            time.sleep(delay)
+            more = self._changed()
+            if not more:
+                return changed
+            changed |= more
+
+
+class InotifyWatcher:
+    """Finds changed templates using linux inotify."""
+
+    def __init__(self, paths: Sequence[str]) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        self.paths = paths
+        self._directories: dict[int, str] = {}
+        # directories given (or found) as paths report all of their templates
+        self._recursive: set[int] = set()
+        # otherwise only the files given as paths are reported (as given)
+        self._files: dict[str, str] = {}
+        try:
+            for path in paths:
+                if os.path.isdir(path):
+                    self._watch_tree(path)
+                else:
+                    self._files[os.path.normpath(path)] = path
+                    self._watch(os.path.dirname(path) or '.')
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+    def _watch(self, directory: str) -> int:
+        wd = self._add_watch(
+            self._fd,
+            os.fsencode(directory),
+            IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE,
+        )
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'cannot watch {directory}')
+        self._directories[wd] = directory
+        return wd
+
+    def _watch_tree(self, directory: str) -> None:
+        for dirpath, _, _ in os.walk(directory):
+            self._recursive.add(self._watch(dirpath))
+
+    def _read(self, timeout: float | None) -> set[str]:
+        if not select.select((self._fd,), (), (), timeout)[0]:
+            return set()
+        return self._handle_events(os.read(self._fd, 65536))
+
+    def _handle_events(self, buf: bytes) -> set[str]:
+        ret: set[str] = set()
+        pos = 0
+        while pos < len(buf):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(buf, pos)
+            pos += INOTIFY_EVENT.size
+            name = os.fsdecode(buf[pos:pos + length].rstrip(b'\0'))
+            pos += length
+
+            if mask & IN_Q_OVERFLOW:
+                # events were dropped (a large checkout), anything may have
+                # changed
+                ret.update(find_templates(self.paths))
+                continue
+            elif wd not in self._directories:  # pragma: no cover (removed)
+                continue
+
+            path = os.path.join(self._directories[wd], name)
+            if mask & IN_ISDIR:
+                if wd in self._recursive:
+                    self._watch_tree(path)
+                    ret.update(find_templates((path,)))
+            elif not mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                continue
+            elif os.path.normpath(path) in self._files:
+                ret.add(self._files[os.path.normpath(path)])
+            elif wd in self._recursive and path.endswith(TEMPLATE_EXTENSION):
+                ret.add(path)
+        return ret
+
+    def wait(
+            self,
+            timeout: float | None = None,
+            delay: float = .05,
+    ) -> set[str]:
+        """Block until templates change and return them.  Changes which
+        happen within `delay` seconds of each other are returned together.
+
+        An empty set is returned if nothing changed within `timeout` seconds.
+        """
+        end = None if timeout is None else time.monotonic() + timeout
+        changed: set[str] = set()
+        while not changed:
+            if end is None:
+                remaining = None
+            else:
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    return set()
+            changed = self._read(remaining)
+
+        while True:
+            more = self._read(delay)
+            if not more:
+                return changed
+            changed |= more
+
+
+def get_watcher(paths: Sequence[str]) -> InotifyWatcher | PollingWatcher:
+    if sys.platform == 'linux':  # pragma: linux cover
+        try:
+            return InotifyWatcher(paths)
+        except (OSError, AttributeError):  # unsupported or a missing directory
+            pass
+    return PollingWatcher(paths)  # pragma: linux no cover
+
+
+def watch(paths: Sequence[str], callback: Callable[[str], object]) -> int:
+    """Calls `callback` for every template in `paths` and then again for each
+    template as it changes until interrupted.
+
+    Errors from `callback` (a half edited template which does not parse, a
+    file removed again) are reported and watching continues.
+    """
+    def _callback(filename: str) -> None:
+        try:
+            callback(filename)
+        except Exception as e:
+            print(f'{filename}: {type(e).__name__}: {e}', file=sys.stderr)
+
+    watcher = get_watcher(paths)
+    try:
+        for filename in find_templates(paths):
+            _callback(filename)
+        while True:
+            for filename in sorted(watcher.wait()):
+                _callback(filename)
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        if isinstance(watcher, InotifyWatcher):  # pragma: linux cover
+            watcher.close()
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import io
+import os.path
+import sys
+import tarfile
+import zipfile
+
+import pytest
+
+from cheetah_lint.archive import is_archive
+from cheetah_lint.archive import iter_archive
+from cheetah_lint.archive import iter_inputs
+
+MEMBERS = {
+    'a.tmpl': '#import foo\n',
+    'dir/b.tmpl': 'hello\n',
+    'dir/c.py': 'not a template\n',
+}
+
+
+def write_tar(filename, mode='w'):
+    with tarfile.open(filename, mode) as tar:
+        for name, contents in MEMBERS.items():
+            info = tarfile.TarInfo(name)
+            data = contents.encode('UTF-8')
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+def write_zip(filename):
+    with zipfile.ZipFile(filename, 'w') as zip_file:
+        zip_file.writestr('dir/', '')
+        for name, contents in MEMBERS.items():
+            zip_file.writestr(name, contents)
+
+
+def expected(archive):
+    return [
+        (os.path.join(archive, 'a.tmpl'), '#import foo\n'),
+        (os.path.join(archive, 'dir', 'b.tmpl'), 'hello\n'),
+    ]
+
+
+@pytest.mark.parametrize(
+    ('filename', 'ret'),
+    (
+        ('a.tar', True), ('a.tar.gz', True), ('a.tgz', True),
+        ('a.tar.xz', True), ('a.zip', True),
+        ('a.tmpl', False), ('a.gz', False), ('tar', False),
+    ),
+)
+def test_is_archive(filename, ret):
+    assert is_archive(filename) is ret
+
+
+@pytest.mark.parametrize(
+    ('basename', 'mode'),
+    (('a.tar', 'w'), ('a.tar.gz', 'w:gz'), ('a.tar.bz2', 'w:bz2')),
+)
+def test_iter_archive_tar(tmpdir, basename, mode):
+    filename = tmpdir.join(basename).strpath
+    write_tar(filename, mode)
+    assert list(iter_archive(filename)) == expected(filename)
+
+
+def test_iter_archive_zip(tmpdir):
+    filename = tmpdir.join('a.zip').strpath
+    write_zip(filename)
+    assert list(iter_archive(filename)) == expected(filename)
+
+
+class _Unseekable(io.BytesIO):
+    def seekable(self):
+        return False
+
+    # reading an archive from a stream must not use these
+    def seek(self, *args):  # pragma: no cover (must not be called)
+        raise io.UnsupportedOperation('seek')
+
+    def tell(self):  # pragma: no cover (must not be called)
+        raise io.UnsupportedOperation('tell')
+
+
+@pytest.mark.parametrize('basename', ('a.tar.gz', 'a.zip'))
+def test_iter_archive_unseekable_stream(tmpdir, basename):
+    filename = tmpdir.join(basename).strpath
+    if basename.endswith('.zip'):
+        write_zip(filename)
+    else:
+        write_tar(filename, 'w:gz')
+    with open(filename, 'rb') as f:
+        stream = _Unseekable(f.read())
+    assert list(iter_archive('x/' + basename, stream)) == expected(
+        'x/' + basename,
+    )
+
+
+def _fake_stdin(monkeypatch, data):
+    stdin = io.TextIOWrapper(io.BytesIO(data), encoding='UTF-8')
+    monkeypatch.setattr(sys, 'stdin', stdin)
+
+
+def test_iter_inputs(tmpdir, monkeypatch):
+    filename = tmpdir.join('a.tar').strpath
+    write_tar(filename)
+    _fake_stdin(monkeypatch, b'$foo\n')
+    ret = list(iter_inputs(['x.tmpl', filename, '-']))
+    assert ret == [('x.tmpl', None), *expected(filename), ('stdin', '$foo\n')]
+
+
+def test_iter_inputs_stdin_filename(monkeypatch):
+    _fake_stdin(monkeypatch, b'$foo\n')
+    ret = list(iter_inputs(['-'], stdin_filename='foo.tmpl'))
+    assert ret == [('foo.tmpl', '$foo\n')]
+
+
+def test_iter_inputs_stdin_archive(tmpdir, monkeypatch):
+    filename = tmpdir.join('a.tar').strpath
+    write_tar(filename)
+    with open(filename, 'rb') as f:
+        _fake_stdin(monkeypatch, f.read())
+    ret = list(iter_inputs(['-'], stdin_filename='t.tar'))
+    assert ret == expected('t.tar')
@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import pytest
+
+from cheetah_lint.baseline import Baseline
+from cheetah_lint.baseline import content_hash
+from cheetah_lint.baseline import fingerprint
+
+SRC = '#import foo\n#import bar\n'
+FLAKES = (
+    (1, 'F401', "'foo' imported but unused"),
+    (2, 'F401', "'bar' imported but unused"),
+)
+
+
+def test_fingerprint():
+    assert fingerprint('F401', '#import foo') == (
+        fingerprint('F401', '    #import foo\n')
+    )
+    assert fingerprint('F401', '#import foo') != (
+        fingerprint('F811', '#import foo')
+    )
+    assert fingerprint('F401', '#import foo') != (
+        fingerprint('F401', '#import bar')
+    )
+
+
+def test_filter():
+    baseline = Baseline(('F401',))
+    baseline.record('a.tmpl', SRC, FLAKES)
+    assert baseline.filter('a.tmpl', SRC, FLAKES) == ()
+    # the findings still match after moving
+    moved = '#import baz\n$baz\n' + SRC
+    moved_flakes = tuple((line + 2, code, msg) for line, code, msg in FLAKES)
+    assert baseline.filter('a.tmpl', moved, moved_flakes) == ()
+    assert baseline.filter('b.tmpl', SRC, FLAKES) == FLAKES
+
+
+def test_filter_counts_findings():
+    baseline = Baseline(('F401',))
+    baseline.record('a.tmpl', '#import foo\n', FLAKES[:1])
+    src = '#import foo\n#import foo\n'
+    flakes = (
+        (1, 'F401', "'foo' imported but unused"),
+        (2, 'F811', "redefinition of unused 'foo' from line 1"),
+        (2, 'F401', "'foo' imported but unused"),
+    )
+    # only one of the two F401s on an `#import foo` line was recorded
+    assert baseline.filter('a.tmpl', src, flakes) == flakes[1:]
+
+
+def test_filter_line_out_of_range():
+    baseline = Baseline(('T005',))
+    flakes = ((1, 'T005', 'File is empty'),)
+    baseline.record('a.tmpl', '', flakes)
+    assert baseline.filter('a.tmpl', '', flakes) == ()
+
+
+def test_is_unchanged():
+    baseline = Baseline(('F401', 'T005'))
+    baseline.record('a.tmpl', SRC, FLAKES)
+    assert baseline.is_unchanged('a.tmpl', SRC, frozenset(('F401',)))
+    assert not baseline.is_unchanged('a.tmpl', SRC + '\n', frozenset())
+    assert not baseline.is_unchanged('b.tmpl', SRC, frozenset())
+    # other codes may have findings which were not recorded
+    assert not baseline.is_unchanged('a.tmpl', SRC, frozenset(('F811',)))
+
+
+def test_filenames_are_normalized(tmpdir):
+    baseline = Baseline(('F401',), root=tmpdir.strpath)
+    with tmpdir.as_cwd():
+        baseline.record('./templates/../a.tmpl', SRC, FLAKES)
+        assert set(baseline.files) == {'a.tmpl'}
+        assert baseline.filter('a.tmpl', SRC, FLAKES) == ()
+        absolute = tmpdir.join('a.tmpl').strpath
+        assert baseline.filter(absolute, SRC, FLAKES) == ()
+    # relative to the baseline's directory, not the working directory
+    with tmpdir.join('sub').ensure_dir().as_cwd():
+        assert baseline.filter('../a.tmpl', SRC, FLAKES) == ()
+        assert baseline.filter('a.tmpl', SRC, FLAKES) == FLAKES
+
+
+def test_load_relative_to_baseline_file(tmpdir):
+    filename = tmpdir.join('baseline.json').strpath
+    with tmpdir.as_cwd():
+        baseline = Baseline(('F401',))
+        baseline.record('a.tmpl', SRC, FLAKES)
+        baseline.save(filename)
+    with tmpdir.join('sub').ensure_dir().as_cwd():
+        loaded = Baseline.load('../baseline.json')
+        assert loaded.is_unchanged('../a.tmpl', SRC, frozenset(('F401',)))
+
+
+def test_save_and_load(tmpdir):
+    filename = tmpdir.join('baseline.json').strpath
+    baseline = Baseline(('F401',))
+    baseline.record('a.tmpl', SRC, FLAKES)
+    baseline.save(filename)
+    loaded = Baseline.load(filename)
+    assert loaded.codes == frozenset(('F401',))
+    assert loaded.files == baseline.files
+    assert loaded.files['a.tmpl'].hash == content_hash(SRC)
+
+
+def test_load_unsupported_version(tmpdir):
+    tmpdir.join('baseline.json').write('{"version": 2}')
+    with pytest.raises(ValueError):
+        Baseline.load(tmpdir.join('baseline.json').strpath)
+
+
+@pytest.mark.parametrize(
+    'contents',
+    (
+        '[]',
+        '"baseline"',
+        '{"version": 1}',
+        '{"version": 1, "codes": [], "files": []}',
+        '{"version": 1, "codes": "F401", "files": {}}',
+        '{"version": 1, "codes": [1], "files": {}}',
+        '{"version": 1, "codes": [], "files": {"a.tmpl": []}}',
+        '{"version": 1, "codes": [], "files": {"a.tmpl": {"hash": "h"}}}',
+        '{"version": 1, "codes": [], "files": {"a.tmpl": {"findings": {}}}}',
+        (
+            '{"version": 1, "codes": [], '
+            '"files": {"a.tmpl": {"hash": "h", "findings": {"f": "1"}}}}'
+        ),
+    ),
+)
+def test_load_invalid(tmpdir, contents):
+    tmpdir.join('baseline.json').write(contents)
+    with pytest.raises(ValueError):
+        Baseline.load(tmpdir.join('baseline.json').strpath)
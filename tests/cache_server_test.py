@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import http.client
+import json
+import os
+import threading
+
+import pytest
+
+from cheetah_lint.cache_server import DirectoryStore
+from cheetah_lint.cache_server import main
+from cheetah_lint.cache_server import MemoryStore
+from cheetah_lint.cache_server import Server
+
+KEY = 'a' * 64
+
+
+def serve(store, verbose=False):
+    server = Server(('127.0.0.1', 0), store, verbose)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    return server, thread
+
+
+@pytest.fixture
+def server():
+    server, thread = serve(MemoryStore())
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+
+
+@pytest.fixture
+def connection(server):
+    connection = http.client.HTTPConnection('127.0.0.1', server.server_port)
+    try:
+        yield connection
+    finally:
+        connection.close()
+
+
+def request(connection, method, path, body=None):
+    data = body if isinstance(body, bytes) else json.dumps(body).encode()
+    connection.request(method, path, body=data)
+    response = connection.getresponse()
+    contents = response.read()
+    return response.status, json.loads(contents) if contents else None
+
+
+def test_get_missing(connection):
+    assert request(connection, 'GET', f'/{KEY}') == (404, None)
+
+
+def test_put_and_get(connection):
+    assert request(connection, 'PUT', f'/{KEY}', [[1, 'T005', 'x']]) == (
+        204, None,
+    )
+    assert request(connection, 'GET', f'/{KEY}') == (200, [[1, 'T005', 'x']])
+
+
+def test_mounted_anywhere(connection):
+    request(connection, 'PUT', f'/some/prefix/{KEY}', [])
+    assert request(connection, 'GET', f'/{KEY}') == (200, [])
+
+
+@pytest.mark.parametrize(
+    ('method', 'path', 'body'),
+    (
+        ('PUT', '/notakey', []),
+        ('PUT', f'/{KEY}', {'not': 'a list'}),
+        ('POST', '/get', {'not': 'a list'}),
+        ('POST', '/put', []),
+        ('POST', '/other', []),
+        ('PUT', f'/{KEY}', b'[not json'),
+        ('POST', '/get', b'[not json'),
+    ),
+)
+def test_bad_requests(connection, method, path, body):
+    assert request(connection, method, path, body)[0] == 400
+
+
+def test_batches(connection):
+    other = 'b' * 64
+    body = {KEY: [], other: [[1]], 'notakey': [], 'c' * 64: 'not a list'}
+    assert request(connection, 'POST', '/put', body) == (200, {})
+    ret = request(connection, 'POST', '/get', [KEY, other, 'c' * 64, 'x'])
+    assert ret == (200, {KEY: [], other: [[1]]})
+
+
+def test_keep_alive(connection):
+    for _ in range(3):
+        request(connection, 'POST', '/get', [KEY])
+    # all requests were served on the same connection
+    assert connection.sock is not None
+
+
+def test_directory_store(tmpdir):
+    store = DirectoryStore(tmpdir.join('cache').strpath)
+    assert store.get(KEY) is None
+    store.put(KEY, b'[]')
+    assert store.get(KEY) == b'[]'
+    assert tmpdir.join('cache', 'aa', KEY).read() == '[]'
+    assert DirectoryStore(tmpdir.join('cache').strpath).get(KEY) == b'[]'
+
+
+def test_directory_store_write_error(tmpdir, monkeypatch):
+    def replace(src, dst):
+        raise OSError('disk full')
+
+    store = DirectoryStore(tmpdir.strpath)
+    monkeypatch.setattr(os, 'replace', replace)
+    with pytest.raises(OSError):
+        store.put(KEY, b'[]')
+    # the temporary file is not left behind
+    assert os.listdir(tmpdir.join('aa').strpath) == []
+    assert store.get(KEY) is None
+
+
+def test_verbose(capsys):
+    server, thread = serve(MemoryStore(), verbose=True)
+    connection = http.client.HTTPConnection('127.0.0.1', server.server_port)
+    try:
+        request(connection, 'GET', f'/{KEY}')
+    finally:
+        connection.close()
+        server.shutdown()
+        thread.join()
+        server.server_close()
+    _, err = capsys.readouterr()
+    assert f'"GET /{KEY} HTTP/1.1" 404' in err
+
+
+@pytest.fixture
+def interrupted(monkeypatch):
+    servers = []
+
+    def serve_forever(self, poll_interval=.5):
+        servers.append(self)
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(Server, 'serve_forever', serve_forever)
+    return servers
+
+
+def test_main(interrupted, capsys):
+    assert main(['--port', '0']) == 0
+    server, = interrupted
+    assert isinstance(server.store, MemoryStore)
+    assert not server.verbose
+    out, _ = capsys.readouterr()
+    assert out == f'Serving on http://127.0.0.1:{server.server_port}\n'
+
+
+def test_main_directory(interrupted, tmpdir):
+    args = ['--port', '0', '--directory', tmpdir.strpath, '--verbose']
+    assert main(args) == 0
+    server, = interrupted
+    assert isinstance(server.store, DirectoryStore)
+    assert server.store.directory == tmpdir.strpath
+    assert server.verbose
@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import socket
+import threading
+
+import pytest
+
+from cheetah_lint.cache import cache_key
+from cheetah_lint.cache import get_versions
+from cheetah_lint.cache import KEY_RE
+from cheetah_lint.cache import RemoteCache
+from cheetah_lint.cache_server import Handler
+from cheetah_lint.cache_server import MemoryStore
+from tests.cache_server_test import serve
+
+KEY = cache_key('')
+
+
+def test_get_versions():
+    versions = get_versions()
+    assert versions.startswith('python=')
+    assert '\nyelp-cheetah=' in versions
+
+
+def test_cache_key():
+    key = cache_key('#import foo\n', ('codes=F401',))
+    assert KEY_RE.match(key)
+    assert key == cache_key('#import foo\n', ('codes=F401',))
+    assert key != cache_key('#import foo\n', ('codes=F401,T005',))
+    assert key != cache_key('#import bar\n', ('codes=F401',))
+    # the parts cannot run into each other
+    assert cache_key('b', ('a',)) != cache_key('', ('ab',))
+
+
+@pytest.fixture
+def server():
+    server, thread = serve(MemoryStore())
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+
+
+@pytest.fixture
+def requests(monkeypatch):
+    requests = []
+    do_POST = Handler.do_POST
+
+    def recording_do_POST(self):
+        requests.append(self.path)
+        return do_POST(self)
+
+    monkeypatch.setattr(Handler, 'do_POST', recording_do_POST)
+    return requests
+
+
+def test_remote_cache(server, requests):
+    url = f'http://127.0.0.1:{server.server_port}/cache'
+    keys = [cache_key(str(i)) for i in range(10)]
+    with RemoteCache(url) as cache:
+        assert cache.get_many(keys) == {}
+        for i, key in enumerate(keys[:5]):
+            cache.put(key, [[i, 'T005', 'File is empty']])
+    assert requests[0] == '/cache/get'
+    # the stores are sent in the background, a few at a time
+    assert 1 <= requests.count('/cache/put') <= 5
+
+    with RemoteCache(url) as cache:
+        assert cache.get_many(keys) == {
+            key: [[i, 'T005', 'File is empty']]
+            for i, key in enumerate(keys[:5])
+        }
+        assert cache.get_many([]) == {}
+
+
+def test_remote_cache_reconnects(server):
+    url = f'http://127.0.0.1:{server.server_port}'
+    key = cache_key('')
+    with RemoteCache(url) as cache:
+        cache.put(key, [])
+    with RemoteCache(url) as cache:
+        # as if the server had closed the keep-alive connection
+        cache._get_connection.connect()
+        assert cache._get_connection.sock is not None
+        cache._get_connection.sock.close()
+        assert cache.get_many([key]) == {key: []}
+
+
+def test_remote_cache_unreachable():
+    with RemoteCache('http://127.0.0.1:1', timeout=1) as cache:
+        assert cache.get_many([cache_key('')]) == {}
+        cache.put(cache_key(''), [])
+
+
+def test_remote_cache_https_unreachable():
+    with RemoteCache('https://127.0.0.1:1', timeout=1) as cache:
+        assert cache.get_many([KEY]) == {}
+
+
+@pytest.fixture
+def unresponsive():
+    # connections are accepted (into the backlog) but never answered
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        sock.listen()
+        yield f'http://127.0.0.1:{sock.getsockname()[1]}'
+
+
+@pytest.fixture
+def posts(monkeypatch):
+    posts = []
+    post = RemoteCache._post
+
+    def recording_post(self, connection, path, data):
+        posts.append(path)
+        return post(self, connection, path, data)
+
+    monkeypatch.setattr(RemoteCache, '_post', recording_post)
+    return posts
+
+
+def test_remote_cache_unresponsive(unresponsive, posts):
+    with RemoteCache(unresponsive, timeout=.1) as cache:
+        assert cache.get_many([KEY]) == {}
+        # the server is not asked again (nor retried after the timeout)
+        assert cache.get_many([KEY]) == {}
+        cache.put(KEY, [])
+    assert posts == ['/get']
+
+
+def test_remote_cache_unreachable_stops_stores(posts):
+    with RemoteCache('http://127.0.0.1:1') as cache:
+        cache.put(KEY, [])
+        assert cache._unavailable.wait(timeout=5)
+        assert cache.get_many([KEY]) == {}
+    # the store failed (and was retried), the lookup was not attempted
+    assert posts == ['/put', '/put']
+
+
+def test_remote_cache_close_does_not_wait_when_unavailable(monkeypatch):
+    sending, release = threading.Event(), threading.Event()
+
+    def _post(connection, path, data):
+        if path == '/put':
+            sending.set()
+            release.wait()
+        raise socket.timeout()
+
+    with RemoteCache('http://127.0.0.1:1') as cache:
+        monkeypatch.setattr(cache, '_post', _post)
+        cache.put(KEY, [])
+        assert sending.wait(timeout=5)
+        assert cache.get_many([KEY]) == {}
+    # the store is still waiting for its answer
+    assert cache._put_thread.is_alive()
+    release.set()
+    cache._put_thread.join()
+
+
+def test_remote_cache_error_status(server, monkeypatch):
+    monkeypatch.setattr(Handler, 'do_POST', lambda self: self._respond(500))
+    url = f'http://127.0.0.1:{server.server_port}'
+    with RemoteCache(url) as cache:
+        assert cache.get_many([KEY]) == {}
+
+
+def test_remote_cache_invalid_url():
+    with pytest.raises(ValueError):
+        RemoteCache('ftp://example.com')
+
+
+@pytest.mark.parametrize(
+    'response',
+    (
+        [],
+        'not a dict',
+        {KEY: 'not a list'},
+        {KEY: [[1, 'T005']]},
+        {KEY: [['1', 'T005', 'File is empty']]},
+        {KEY: [[1, 'T005', None]]},
+        {KEY: [1]},
+    ),
+)
+def test_remote_cache_bad_responses_miss(response, monkeypatch):
+    with RemoteCache('http://127.0.0.1:1') as cache:
+        monkeypatch.setattr(cache, '_request', lambda *args: response)
+        assert cache.get_many([KEY]) == {}
+
+
+def test_remote_cache_good_entries_of_bad_response(monkeypatch):
+    other = cache_key('other')
+    response = {KEY: [[1, 'T005', 'File is empty']], other: None}
+    with RemoteCache('http://127.0.0.1:1') as cache:
+        monkeypatch.setattr(cache, '_request', lambda *args: response)
+        assert cache.get_many([KEY, other]) == {
+            KEY: [[1, 'T005', 'File is empty']],
+        }
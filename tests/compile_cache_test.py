@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import os
+import pickle
+
+import pytest
+
+from cheetah_lint import compile_cache
+from cheetah_lint.compile_cache import CompileCache
+
+COMPILED = ('import foo\n', {1: 1})
+
+
+def _entries(directory):
+    return [
+        os.path.join(dirpath, filename)
+        for dirpath, _, filenames in os.walk(directory)
+        for filename in filenames
+    ]
+
+
+def test_get_missing(tmpdir):
+    assert CompileCache(tmpdir.strpath, 1024).get('#import foo\n') is None
+
+
+def test_put_and_get(tmpdir):
+    cache = CompileCache(tmpdir.join('cache').strpath, 1024)
+    cache.put('#import foo\n', COMPILED)
+    assert cache.get('#import foo\n') == COMPILED
+    assert cache.get('#import bar\n') is None
+    # shared with other instances (and processes) using the directory
+    other = CompileCache(tmpdir.join('cache').strpath, 1024)
+    assert other.get('#import foo\n') == COMPILED
+
+
+def test_keyed_by_compiler_versions(tmpdir, monkeypatch):
+    cache = CompileCache(tmpdir.strpath, 1024)
+    cache.put('#import foo\n', COMPILED)
+    monkeypatch.setattr(
+        compile_cache, 'get_versions', lambda distributions: 'other',
+    )
+    assert cache.get('#import foo\n') is None
+
+
+@pytest.mark.parametrize(
+    'contents',
+    (
+        '{',
+        '1',
+        '["import foo\\n", [1, 1]]',
+        '["import foo\\n", {"a": 1}]',
+        '[1, {"1": 1}]',
+    ),
+)
+def test_corrupt_entry(tmpdir, contents):
+    cache = CompileCache(tmpdir.strpath, 1024)
+    cache.put('#import foo\n', COMPILED)
+    filename, = _entries(tmpdir.strpath)
+    with open(filename, 'w') as f:
+        f.write(contents)
+    assert cache.get('#import foo\n') is None
+
+
+def test_evicts_least_recently_used(tmpdir):
+    entry_size = len('["import foo\\n", {"1": 1}]')
+    cache = CompileCache(tmpdir.strpath, 3 * entry_size)
+    for i, src in enumerate(('a', 'b', 'c')):
+        cache.put(src, COMPILED)
+        filename = cache._filename(src)
+        os.utime(filename, (i, i))
+    # using 'a' makes 'b' the least recently used
+    assert cache.get('a') == COMPILED
+    cache.put('d', COMPILED)
+    assert cache.get('b') is None
+    assert len(_entries(tmpdir.strpath)) == 2
+
+
+def test_pickle(tmpdir):
+    cache = CompileCache(tmpdir.strpath, 1024)
+    cache.put('#import foo\n', COMPILED)
+    unpickled = pickle.loads(pickle.dumps(cache.deferring()))
+    assert unpickled.max_size == 1024
+    assert unpickled.deferred
+    assert unpickled.get('#import foo\n') == COMPILED
+
+
+def test_deferring(tmpdir):
+    cache = CompileCache(tmpdir.strpath, 1024)
+    deferring = cache.deferring()
+    deferring.put('#import foo\n', COMPILED)
+    # left to the original to store
+    assert deferring.pending == [('#import foo\n', COMPILED)]
+    assert cache.get('#import foo\n') is None
+    assert _entries(tmpdir.strpath) == []
+
+
+def test_put_error(tmpdir, monkeypatch):
+    def replace(src, dst):
+        raise OSError('disk full')
+
+    cache = CompileCache(tmpdir.strpath, 1024)
+    monkeypatch.setattr(os, 'replace', replace)
+    cache.put('#import foo\n', COMPILED)
+    # the temporary file is not left behind
+    assert _entries(tmpdir.strpath) == []
+    assert cache.get('#import foo\n') is None
+
+
+def test_evict_entries_removed_concurrently(tmpdir, monkeypatch):
+    entry_size = len('["import foo\\n", {"1": 1}]')
+    cache = CompileCache(tmpdir.strpath, 2 * entry_size)
+    cache.put('a', COMPILED)
+    cache.put('b', COMPILED)
+    stat = os.stat
+
+    def stat_removed(path):
+        if path == cache._filename('a'):
+            raise FileNotFoundError(path)
+        return stat(path)
+
+    def remove_fails(path):
+        raise PermissionError(path)
+
+    monkeypatch.setattr(os, 'stat', stat_removed)
+    monkeypatch.setattr(os, 'remove', remove_fails)
+    cache.put('c', COMPILED)
+    # 'a' was not found and 'b' could not be removed
+    assert len(_entries(tmpdir.strpath)) == 3
+    assert cache._size == 2 * entry_size
@@ -3,6 +3,7 @@ from __future__ import annotations
 from refactorlib.cheetah.parse import parse
 
 from cheetah_lint.directives import get_all_imports
+from cheetah_lint.directives import get_all_imports_in_order
 from cheetah_lint.directives import get_compiler_settings_directive
 from cheetah_lint.directives import get_extends_directive
 from cheetah_lint.directives import get_implements_directive
@@ -55,3 +56,14 @@ def test_get_imports():
         '#from foo.bar import baz\n',
         '#from a import b as c\n',
     ]
+
+
+def test_get_imports_in_order():
+    doc = parse('#from foo import bar\n#import baz\n#from a import b\n')
+    ret = get_all_imports_in_order(doc)
+    to_texts = [el.directive_element.totext(encoding='unicode') for el in ret]
+    assert to_texts == [
+        '#from foo import bar\n',
+        '#import baz\n',
+        '#from a import b\n',
+    ]
@@ -1,16 +1,48 @@
 from __future__ import annotations
 
+import concurrent.futures
+import contextlib
+import io
+import multiprocessing
+import os
+import select
+import signal
+import subprocess
+import sys
+import tarfile
+import threading
+import time
+
 import pytest
+from Cheetah.compile import compile_source
 
+from cheetah_lint import flake
+from cheetah_lint.cache import RemoteCache
+from cheetah_lint.cache_server import MemoryStore
+from cheetah_lint.compile_cache import CompileCache
 from cheetah_lint.flake import _find_bounds
 from cheetah_lint.flake import _get_line_no_from_comments
+from cheetah_lint.flake import _kill_worker
 from cheetah_lint.flake import filter_known_errors
+from cheetah_lint.flake import ALL_CODES
+from cheetah_lint.flake import compile_for_lint
+from cheetah_lint.flake import get_enabled_codes
+from cheetah_lint.flake import get_cached
 from cheetah_lint.flake import get_flakes
+from cheetah_lint.flake import get_flakes_limited
 from cheetah_lint.flake import LINE_ERROR_MSG_RE
 from cheetah_lint.flake import LINECOL_COMMENT_RE
+from cheetah_lint.flake import lint_pipelined
 from cheetah_lint.flake import main
+from cheetah_lint.flake import NoCompilerSettingsCompiler
 from cheetah_lint.flake import PY_DEF_RE
+from cheetah_lint.flake import read_precompiled
 from cheetah_lint.flake import STRIP_SYMBOLS_RE
+from cheetah_lint.flake import Template
+from cheetah_lint.flake import to_py
+from cheetah_lint.shard import load_durations
+from cheetah_lint.util import read_file
+from tests.cache_server_test import serve
 
 
 def test_filter_known_unused_imports_filters_known():
@@ -477,12 +509,23 @@ def test_context_manager():
     ) == ()
 
 
-def test_cannot_determine_line_number():
+def test_multiline_placeholder_line_number():
     assert get_flakes(
         '$foo(\n'
         '    $bar == True,\n'
         ')',
     ) == (
+        (
+            2,
+            'E712',
+            "comparison to True should be 'if cond is True:' or 'if cond:'",
+        ),
+    )
+
+
+def test_cannot_determine_line_number_without_source_map():
+    src = '$foo(\n    $bar == True,\n)'
+    assert get_flakes(src, py_source=to_py(src)) == (
         (
             0,
             'E712',
@@ -491,6 +534,17 @@ def test_cannot_determine_line_number():
     )
 
 
+def test_line_number_from_comments_without_source_map():
+    src = '#import foo\n\n${foo == True}\n'
+    assert get_flakes(src, py_source=to_py(src)) == (
+        (
+            3,
+            'E712',
+            "comparison to True should be 'if cond is True:' or 'if cond:'",
+        ),
+    )
+
+
 def test_implements_respond_no_extend():
     assert get_flakes('#implements respond') == (
         (1, 'T001', "'#implements respond' is assumed without '#extends'"),
@@ -570,3 +624,1051 @@ def test_compiler_settings():
     assert get_flakes(
         '#compiler-settings#useLegacyImportMode = True#end compiler-settings#',
     ) == ()
+
+
+def _slow_to_py(src):  # pragma: no cover (in the worker process)
+    time.sleep(5)
+    raise AssertionError('unreachable')
+
+
+def _huge_to_py(src):
+    return ' ' * (2 ** 32)
+
+
+def _broken_to_py(src):  # pragma: no cover (in the worker process)
+    raise ValueError('bad template')
+
+
+def test_get_flakes_memory_limit(monkeypatch):
+    monkeypatch.setattr(flake, 'compile_for_lint', _huge_to_py)
+    assert get_flakes('#import foo', max_memory=256 * 1024 * 1024) == (
+        (1, 'T007', 'Linting exceeded the memory limit'),
+    )
+
+
+def test_get_flakes_limited_no_limits():
+    assert get_flakes_limited('#import foo') == (
+        (1, 'F401', "'foo' imported but unused"),
+    )
+
+
+def test_get_flakes_limited_timeout(monkeypatch):
+    monkeypatch.setattr(flake, 'compile_for_lint', _slow_to_py)
+    assert get_flakes_limited('#import foo', timeout=.1) == (
+        (1, 'T006', 'Linting exceeded the time limit (0.1s)'),
+    )
+
+
+def test_get_flakes_limited_reraises(monkeypatch):
+    monkeypatch.setattr(flake, 'compile_for_lint', _broken_to_py)
+    with pytest.raises(ValueError) as excinfo:
+        get_flakes_limited('#import foo', timeout=5)
+    msg, = excinfo.value.args
+    assert msg == 'bad template'
+
+
+def _slow_for_slow_to_py(src):  # pragma: no cover (in the worker process)
+    if 'slow' in src:
+        _slow_to_py(src)
+    return compile_for_lint(src)
+
+
+def test_main_timeout_continues_with_other_files(tmpdir, capsys, monkeypatch):
+    monkeypatch.setattr(flake, 'compile_for_lint', _slow_for_slow_to_py)
+    slow_file = tmpdir.join('slow.tmpl')
+    slow_file.write('Hello slow world')
+    other_file = tmpdir.join('other.tmpl')
+    other_file.write('#import foo\n')
+    args = ['--timeout', '1', slow_file.strpath, other_file.strpath]
+    assert main(args) == 1
+    out, _ = capsys.readouterr()
+    assert out == (
+        f'{slow_file.strpath}:1 T006 Linting exceeded the time limit (1.0s)\n'
+        f"{other_file.strpath}:1 F401 'foo' imported but unused\n"
+    )
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='no process groups')
+def test_get_flakes_limited_timeout_kills_subprocess(monkeypatch):
+    # the pipe is at its end once every process holding it has exited
+    r, w = os.pipe()
+
+    def check_hangs(py_lines):  # pragma: no cover (in the worker process)
+        subprocess.run(
+            (sys.executable, '-c', 'import time; time.sleep(30)'),
+            pass_fds=(w,),
+        )
+        raise AssertionError('unreachable')
+
+    monkeypatch.setitem(flake.PY_CHECK_CODES, check_hangs, frozenset(('X',)))
+    monkeypatch.setattr(flake, 'PY_CHECKS', (check_hangs,))
+    try:
+        try:
+            assert get_flakes_limited('#import foo', timeout=1) == (
+                (1, 'T006', 'Linting exceeded the time limit (1s)'),
+            )
+        finally:
+            os.close(w)
+        readable, _, _ = select.select([r], [], [], 5)
+        assert readable
+        assert os.read(r, 1) == b''
+    finally:
+        os.close(r)
+
+
+def _dying_worker(conn, *args):  # pragma: no cover (in the worker process)
+    os._exit(1)
+
+
+def test_get_flakes_limited_worker_dies(monkeypatch):
+    monkeypatch.setattr(flake, '_limited_worker', _dying_worker)
+    assert get_flakes_limited('#import foo', timeout=5) == (
+        (1, 'T007', 'Linting exceeded the memory limit'),
+    )
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='no process groups')
+def test_kill_worker_without_process_group():
+    # the worker is killed before it made its own process group
+    proc = multiprocessing.Process(target=time.sleep, args=(30,))
+    proc.start()
+    _kill_worker(proc)
+    proc.join()
+    assert proc.exitcode == -signal.SIGKILL
+
+
+def test_main_max_memory(tmpdir):
+    good_file = tmpdir.join('good.tmpl')
+    good_file.write('Hello world')
+    assert main(['--max-memory', '4096', good_file.strpath]) == 0
+
+
+def test_get_enabled_codes_default_is_everything():
+    assert get_enabled_codes() == ALL_CODES
+
+
+@pytest.mark.parametrize(
+    ('select', 'ignore', 'expected'),
+    (
+        (('T00',), ('T003', 'T006', 'T007'), {'T001', 'T002', 'T004', 'T005'}),
+        (('P',), (), {'P001'}),
+        (('E7',), ('E71',), set()),
+        (('E711',), ('E7',), {'E711'}),
+        (('E711',), ('E711',), set()),
+        (('X',), (), set()),
+    ),
+)
+def test_get_enabled_codes(select, ignore, expected):
+    assert get_enabled_codes(select, ignore) == expected
+
+
+def test_get_enabled_codes_ignore_only():
+    ret = get_enabled_codes(ignore=('F', 'E', 'W'))
+    assert ret == {'P001', *(f'T00{i}' for i in range(1, 8))}
+
+
+def test_get_flakes_only_line_checks_does_not_compile(monkeypatch):
+    monkeypatch.setattr(flake, 'compile_for_lint', _broken_to_py)
+    codes = get_enabled_codes(select=('T',))
+    assert get_flakes('#import foo\n\tbar\n', codes=codes) == (
+        (2, 'T003', 'Indentation contains tabs'),
+    )
+
+
+def test_get_flakes_no_flake8_codes_does_not_run_flake8(monkeypatch):
+    def check_flake8(py_lines):
+        raise AssertionError('unreachable')
+    monkeypatch.setitem(flake.PY_CHECK_CODES, check_flake8, frozenset())
+    monkeypatch.setattr(flake, 'PY_CHECKS', (check_flake8,))
+    assert get_flakes('#import foo', codes=frozenset(('P001',))) == ()
+
+
+def test_get_flakes_filters_flake8_codes():
+    codes = get_enabled_codes(ignore=('F401',))
+    assert get_flakes('#import foo\n#from bar import *\n', codes=codes) == (
+        (
+            2,
+            'F403',
+            "'from bar import *' used; unable to detect undefined names",
+        ),
+    )
+
+
+def test_main_select(tmpdir, capsys):
+    bad_file = tmpdir.join('bad.tmpl')
+    bad_file.write('#import foo\n   bar\n')
+    assert main(['--select', 'T,P', bad_file.strpath]) == 1
+    out, _ = capsys.readouterr()
+    assert out == (
+        f'{bad_file.strpath}:2 T004 Indentation is not a multiple of 4\n'
+    )
+
+
+def test_main_ignore(tmpdir):
+    bad_file = tmpdir.join('bad.tmpl')
+    bad_file.write('#import foo\n')
+    assert main(['--ignore', 'F401', bad_file.strpath]) == 0
+
+
+def test_main_memory_report(tmpdir, capsys):
+    good_file = tmpdir.join('good.tmpl')
+    good_file.write('Hello world')
+    assert main(['--memory-report', good_file.strpath]) == 0
+    _, err = capsys.readouterr()
+    assert err.startswith('Top 10 phases by peak memory:\n')
+    assert f'{good_file.strpath} to_py: peak ' in err
+    assert f'{good_file.strpath} check_flake8: peak ' in err
+    assert f'{good_file.strpath} check_empty: peak ' in err
+
+
+def test_main_memory_report_with_limits():
+    with pytest.raises(SystemExit):
+        main(['--memory-report', '--timeout', '1'])
+
+
+@pytest.fixture
+def precompiled(tmpdir):
+    with tmpdir.as_cwd():
+        tmpdir.join('templates/foo.tmpl').write('#import foo\n', ensure=True)
+        tmpdir.join('build/templates/foo.py').write(
+            to_py('#import foo\n'), ensure=True,
+        )
+        yield tmpdir
+
+
+def test_read_precompiled(precompiled):
+    ret = read_precompiled('templates/foo.tmpl', '#import foo\n', 'build')
+    assert ret == to_py('#import foo\n')
+
+
+def test_read_precompiled_absolute_filename(precompiled):
+    filename = precompiled.join('templates/foo.tmpl').strpath
+    ret = read_precompiled(filename, '#import foo\n', 'build')
+    assert ret == to_py('#import foo\n')
+
+
+def test_read_precompiled_missing(precompiled):
+    precompiled.join('templates/bar.tmpl').write('')
+    assert read_precompiled('templates/bar.tmpl', '', 'build') is None
+
+
+def test_read_precompiled_outside_working_directory(precompiled):
+    with precompiled.join('build').as_cwd():
+        ret = read_precompiled('../templates/foo.tmpl', '#import foo\n', '.')
+        assert ret is None
+
+
+def test_read_precompiled_stale(precompiled):
+    mtime = os.path.getmtime('templates/foo.tmpl')
+    os.utime('build/templates/foo.py', (mtime - 10, mtime - 10))
+    ret = read_precompiled('templates/foo.tmpl', '#import foo\n', 'build')
+    assert ret is None
+
+
+def test_read_precompiled_not_cheetah(precompiled):
+    precompiled.join('build/templates/foo.py').write('import foo\n')
+    ret = read_precompiled('templates/foo.tmpl', '#import foo\n', 'build')
+    assert ret is None
+
+
+def test_read_precompiled_compiler_settings(precompiled):
+    src = (
+        '#compiler-settings\n'
+        'useLegacyImportMode = False\n'
+        '#end compiler-settings\n'
+        '#import foo\n'
+    )
+    precompiled.join('templates/foo.tmpl').write(src)
+    mtime = os.path.getmtime('templates/foo.tmpl')
+    os.utime('build/templates/foo.py', (mtime + 10, mtime + 10))
+    assert read_precompiled('templates/foo.tmpl', src, 'build') is None
+
+
+def _write_different_precompiled(precompiled):
+    # the module is compiled from different source, showing it is used
+    precompiled.join('templates/foo.tmpl').write('#import bar\n$bar\n')
+    precompiled.join('build/templates/foo.py').write(to_py('#import bar\n'))
+
+
+def test_main_precompiled(precompiled, capsys):
+    _write_different_precompiled(precompiled)
+    assert main(['--precompiled', 'build', 'templates/foo.tmpl']) == 1
+    out, _ = capsys.readouterr()
+    assert out == "templates/foo.tmpl:1 F401 'bar' imported but unused\n"
+
+
+def test_main_precompiled_falls_back_to_compiling(precompiled, capsys):
+    assert main(['--precompiled', 'elsewhere', 'templates/foo.tmpl']) == 1
+    out, _ = capsys.readouterr()
+    assert out == "templates/foo.tmpl:1 F401 'foo' imported but unused\n"
+
+
+def test_main_precompiled_with_limits(precompiled, capsys):
+    _write_different_precompiled(precompiled)
+    args = ['--precompiled', 'build', '--timeout', '5', 'templates/foo.tmpl']
+    assert main(args) == 1
+    out, _ = capsys.readouterr()
+    assert out == "templates/foo.tmpl:1 F401 'bar' imported but unused\n"
+
+
+def test_main_shard_and_durations(tmpdir, capsys):
+    with tmpdir.as_cwd():
+        tmpdir.join('a.tmpl').write('#import a\n' * 10)
+        tmpdir.join('b.tmpl').write('#import b\n')
+        tmpdir.join('c.tmpl').write('#import c\n')
+        assert main([
+            '--shard', '2/2', '--durations', 'durations.json',
+            '--select', 'F401', 'a.tmpl', 'b.tmpl', 'c.tmpl',
+        ]) == 1
+        assert set(load_durations('durations.json')) == {'b.tmpl', 'c.tmpl'}
+
+    out, _ = capsys.readouterr()
+    assert out == (
+        "b.tmpl:1 F401 'b' imported but unused\n"
+        "c.tmpl:1 F401 'c' imported but unused\n"
+    )
+
+
+def test_get_flakes_fail_fast_skips_compiling(monkeypatch):
+    monkeypatch.setattr(flake, 'compile_for_lint', _broken_to_py)
+    assert get_flakes('#import foo\n\tbar\n', fail_fast=True) == (
+        (2, 'T003', 'Indentation contains tabs'),
+    )
+
+
+def test_get_flakes_fail_fast_skips_flake8(monkeypatch):
+    def check_flake8(py_lines):
+        raise AssertionError('unreachable')
+    monkeypatch.setitem(flake.PY_CHECK_CODES, check_flake8, frozenset())
+    checks = (flake.check_unicode_literals, check_flake8)
+    monkeypatch.setattr(flake, 'PY_CHECKS', checks)
+    ret = get_flakes("$_(u'hi')", fail_fast=True)
+    assert [code for _, code, _ in ret] == ['P001']
+
+
+def test_get_flakes_fail_fast_runs_everything_when_clean():
+    assert get_flakes('#import foo\n$foo\n', fail_fast=True) == ()
+
+
+@pytest.fixture
+def two_bad_files(tmpdir):
+    with tmpdir.as_cwd():
+        tmpdir.join('a.tmpl').write('#import foo\n#import bar\n')
+        tmpdir.join('b.tmpl').write('#import baz\n')
+        yield
+
+
+def test_main_fail_fast(two_bad_files, capsys):
+    assert main(['--fail-fast', 'a.tmpl', 'b.tmpl']) == 1
+    out, _ = capsys.readouterr()
+    assert out == (
+        "a.tmpl:1 F401 'foo' imported but unused\n"
+        "a.tmpl:2 F401 'bar' imported but unused\n"
+    )
+
+
+def test_main_count(two_bad_files, capsys):
+    assert main(['--count', 'a.tmpl', 'b.tmpl']) == 1
+    out, _ = capsys.readouterr()
+    assert out == '3\n'
+
+
+def test_main_exit_zero(two_bad_files, capsys):
+    assert main(['--exit-zero', 'a.tmpl', 'b.tmpl']) == 0
+    out, _ = capsys.readouterr()
+    assert out.count('\n') == 3
+
+
+CONCURRENT_TEMPLATES = tuple(
+    f'#import foo{i}\n#import bar\n$bar\n'
+    f'#def f{i}()\n#py x = {i}\n#end def\n'
+    f'$bar(u"{i}")\n'
+    f'{"  " * (i % 3)}$bar\n'
+    for i in range(8)
+)
+
+
+def test_get_flakes_concurrent_matches_serial():
+    expected = [get_flakes(template) for template in CONCURRENT_TEMPLATES]
+    assert all(expected)
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        for _ in range(2):
+            ret = list(executor.map(get_flakes, CONCURRENT_TEMPLATES))
+            assert ret == expected
+
+
+def test_get_flakes_concurrent_overlaps_subprocesses(monkeypatch):
+    # Only waiting on the flake8 subprocess overlaps between threads:
+    # compiling is serialized (see `compile_lock`) and the other checks hold
+    # the GIL.  A subprocess which only sleeps stands in for flake8.
+    lock = threading.Lock()
+    running = most = 0
+
+    def check_subprocess(py_lines):
+        nonlocal running, most
+        with lock:
+            running += 1
+            most = max(most, running)
+        subprocess.check_call(
+            (sys.executable, '-c', 'import time; time.sleep(.25)'),
+        )
+        with lock:
+            running -= 1
+        return ()
+
+    monkeypatch.setitem(
+        flake.PY_CHECK_CODES, check_subprocess, frozenset(('X',)),
+    )
+    monkeypatch.setattr(flake, 'PY_CHECKS', (check_subprocess,))
+
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        list(executor.map(get_flakes, CONCURRENT_TEMPLATES))
+    assert most > 1
+
+
+@pytest.fixture
+def many_files(tmpdir):
+    with tmpdir.as_cwd():
+        filenames = []
+        for i, template in enumerate(CONCURRENT_TEMPLATES):
+            tmpdir.join(f'{i}.tmpl').write(template)
+            filenames.append(f'{i}.tmpl')
+        yield filenames
+
+
+def test_main_jobs(many_files, capsys):
+    assert main(many_files) == 1
+    expected, _ = capsys.readouterr()
+    assert main(['--jobs', '8', *many_files]) == 1
+    out, _ = capsys.readouterr()
+    assert sorted(out.splitlines()) == sorted(expected.splitlines())
+
+
+def test_main_jobs_most_expensive_first(tmpdir, capsys):
+    tmpdir.join('small.tmpl').write('#import a\n')
+    tmpdir.join('large.tmpl').write('#import a\n' + '\n' * 100)
+    with tmpdir.as_cwd():
+        assert main(['--jobs', '2', 'small.tmpl', 'large.tmpl']) == 1
+    out, _ = capsys.readouterr()
+    assert out == (
+        "large.tmpl:1 F401 'a' imported but unused\n"
+        "small.tmpl:1 F401 'a' imported but unused\n"
+    )
+
+
+def test_main_durations_invalid(tmpdir):
+    tmpdir.join('durations.json').write('[]')
+    tmpdir.join('a.tmpl').write('')
+    with tmpdir.as_cwd(), pytest.raises(SystemExit):
+        main(['--durations', 'durations.json', 'a.tmpl'])
+
+
+def test_main_jobs_fail_fast(two_bad_files, capsys):
+    assert main(['--jobs', '2', '--fail-fast', 'a.tmpl', 'b.tmpl']) == 1
+    out, _ = capsys.readouterr()
+    assert out == (
+        "a.tmpl:1 F401 'foo' imported but unused\n"
+        "a.tmpl:2 F401 'bar' imported but unused\n"
+    )
+
+
+def test_main_memory_report_with_jobs():
+    with pytest.raises(SystemExit):
+        main(['--memory-report', '--jobs', '2'])
+
+
+MARKUP_TEMPLATE = (
+    '#import foo\n'
+    '<div class="a">\n'
+    '    <p>\'quoted\' """triple""" \\n</p>\n'
+    '</div>\n'
+    '$foo\n'
+    '#def f()\n'
+    '    <span>hi</span>\n'
+    '#end def\n'
+)
+
+
+def _full_to_py(src):
+    return compile_source(src, compiler_cls=NoCompilerSettingsCompiler)
+
+
+def test_to_py_collapses_markup():
+    ret = to_py(MARKUP_TEMPLATE)
+    assert '<div' not in ret
+    assert 'quoted' not in ret
+    assert '<span>' not in ret
+    expected = _full_to_py(MARKUP_TEMPLATE)
+    assert len(ret.splitlines()) == len(expected.splitlines())
+    assert "_v = foo # '$foo' on line 5, col 1\n" in ret
+
+
+@pytest.mark.parametrize(
+    'template',
+    [
+        os.path.join('tests/inputs', template)
+        for template in sorted(os.listdir('tests/inputs'))
+    ],
+)
+def test_to_py_finds_the_same_as_full_compile(template):
+    contents = read_file(template)
+    assert get_flakes(contents) == get_flakes(
+        contents, py_source=_full_to_py(contents),
+    )
+
+
+def test_compile_for_lint_source_map():
+    py_source, source_map = compile_for_lint(
+        '#import foo\n'
+        '#from bar import (baz,\n'
+        '    womp)\n'
+        '<div>\n'
+        '#def f(x)\n'
+        '    #py y = (x,\n'
+        '        $foo)\n'
+        '#end def\n'
+        '$x\n',
+    )
+    assert '\0' not in py_source
+    py_lines = ('',) + tuple(py_source.splitlines())
+    mapped = {
+        py_lines[py_line_no].strip(): line_no
+        for py_line_no, line_no in source_map.items()
+    }
+    assert mapped['import foo'] == 1
+    assert mapped['from bar import (baz,'] == 2
+    assert mapped['womp)'] == 3
+    assert mapped['def f(self, x):'] == 5
+    assert mapped['y = (x,'] == 6
+    assert mapped['foo) # generated from line 6, col 5.'] == 7
+    assert mapped["_v = VFNS(\"x\", NS) # '$x' on line 9, col 1"] == 9
+
+
+def test_compile_for_lint_super_is_not_mapped():
+    py_source, source_map = compile_for_lint(
+        '#extends foo\n'
+        '#def bar(x)\n'
+        '#super(x)\n'
+        '#end def\n',
+    )
+    py_lines = ('',) + tuple(py_source.splitlines())
+    assert 'super(YelpCheetahTemplate, self).bar(x)' in py_source
+    assert {
+        py_lines[py_line_no].strip(): line_no
+        for py_line_no, line_no in source_map.items()
+    } == {'def bar(self, x):': 2}
+
+
+def test_get_flakes_source_map_is_exact(monkeypatch):
+    def _find_fuzzy_line(*args, **kwargs):
+        raise AssertionError('unreachable')
+
+    monkeypatch.setattr(flake, '_find_fuzzy_line', _find_fuzzy_line)
+    # searching for similar lines would find the first import
+    assert get_flakes('#import foo\n$foo.bar\n#import foo\n') == (
+        (3, 'F811', "redefinition of unused 'foo' from line 1"),
+    )
+
+
+def test_main_archive(tmpdir, capsys):
+    filename = tmpdir.join('templates.tar.gz').strpath
+    with tarfile.open(filename, 'w:gz') as tar:
+        for name, contents in (('a.tmpl', b'#import foo\n'), ('b.tmpl', b'')):
+            info = tarfile.TarInfo(name)
+            info.size = len(contents)
+            tar.addfile(info, io.BytesIO(contents))
+    assert main(['--jobs', '2', filename]) == 1
+    out, _ = capsys.readouterr()
+    assert out == (
+        f"{filename}/a.tmpl:1 F401 'foo' imported but unused\n"
+        f'{filename}/b.tmpl:1 T005 File is empty\n'
+    )
+
+
+@pytest.mark.parametrize(
+    ('args', 'name'),
+    (([], 'stdin'), (['--stdin-filename', 'foo.tmpl'], 'foo.tmpl')),
+)
+def test_main_stdin(monkeypatch, capsys, args, name):
+    _fake_stdin(monkeypatch, b'#import foo\n')
+    assert main([*args, '-']) == 1
+    out, _ = capsys.readouterr()
+    assert out == f"{name}:1 F401 'foo' imported but unused\n"
+
+
+def _fake_stdin(monkeypatch, data):
+    stdin = io.TextIOWrapper(io.BytesIO(data), encoding='UTF-8')
+    monkeypatch.setattr(sys, 'stdin', stdin)
+
+
+@pytest.mark.parametrize('filename', ('-', 'a.zip'))
+def test_main_watch_archive_or_stdin(filename):
+    with pytest.raises(SystemExit):
+        main(['--watch', '.', filename])
+
+
+@pytest.mark.parametrize('filename', ('-', 'a.zip', 'a.tar.gz'))
+def test_main_shard_archive_or_stdin(filename):
+    with pytest.raises(SystemExit):
+        main(['--shard', '1/2', 'b.tmpl', filename])
+
+
+@pytest.fixture
+def cache_url():
+    server, thread = serve(MemoryStore())
+    try:
+        yield f'http://127.0.0.1:{server.server_port}'
+    finally:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+
+
+def test_main_cache_url(tmpdir, capsys, monkeypatch, cache_url):
+    tmpdir.join('a.tmpl').write('#import foo\n')
+    tmpdir.join('b.tmpl').write('')
+    filenames = [tmpdir.join('a.tmpl').strpath, tmpdir.join('b.tmpl').strpath]
+    assert main(['--cache-url', cache_url, *filenames]) == 1
+    expected, _ = capsys.readouterr()
+
+    lookups = []
+    get_many = RemoteCache.get_many
+
+    def recording_get_many(self, keys):
+        keys = list(keys)
+        lookups.append(keys)
+        return get_many(self, keys)
+
+    def lint_file(*args, **kwargs):
+        raise AssertionError('should have been cached')
+
+    monkeypatch.setattr(RemoteCache, 'get_many', recording_get_many)
+    monkeypatch.setattr(flake, 'lint_file', lint_file)
+    assert main(['--cache-url', cache_url, '--jobs', '2', *filenames]) == 1
+    out, _ = capsys.readouterr()
+    assert out == expected
+    # both templates were looked up at once
+    assert len(lookups) == 1 and len(lookups[0]) == 2
+
+
+def test_main_cache_url_stdin(monkeypatch, capsys, cache_url):
+    def lint_file(*args, **kwargs):
+        raise AssertionError('should have been cached')
+
+    for _ in range(2):
+        _fake_stdin(monkeypatch, b'#import foo\n')
+        assert main(['--cache-url', cache_url, '-']) == 1
+        out, _ = capsys.readouterr()
+        assert out == "stdin:1 F401 'foo' imported but unused\n"
+        monkeypatch.setattr(flake, 'lint_file', lint_file)
+
+
+def test_main_cache_url_options_change_key(tmpdir, capsys, cache_url):
+    tmpdir.join('a.tmpl').write('#import foo\n')
+    assert main(['--cache-url', cache_url, tmpdir.join('a.tmpl').strpath])
+    capsys.readouterr()
+    ret = main([
+        '--cache-url', cache_url, '--ignore', 'F401',
+        tmpdir.join('a.tmpl').strpath,
+    ])
+    assert ret == 0
+
+
+def test_main_cache_url_limits_not_cached(tmpdir, monkeypatch, cache_url):
+    tmpdir.join('a.tmpl').write('#import foo\n')
+    timed_out = ((1, 'T006', 'Linting exceeded the time limit (1.0s)'),)
+    monkeypatch.setattr(flake, 'lint_file', lambda *a, **k: timed_out)
+    puts = []
+    monkeypatch.setattr(RemoteCache, 'put', lambda *args: puts.append(args))
+    main(['--cache-url', cache_url, tmpdir.join('a.tmpl').strpath])
+    assert puts == []
+
+
+def test_main_cache_url_unreachable(tmpdir, capsys):
+    tmpdir.join('a.tmpl').write('#import foo\n')
+    args = ['--cache-url', 'http://127.0.0.1:1', tmpdir.join('a.tmpl').strpath]
+    assert main(args) == 1
+    out, _ = capsys.readouterr()
+    assert "F401 'foo' imported but unused" in out
+
+
+def test_main_cache_url_with_watch():
+    with pytest.raises(SystemExit):
+        main(['--cache-url', 'http://127.0.0.1:1', '--watch', '.'])
+
+
+def test_lint_pipelined_same_as_get_flakes():
+    sources = (*CONCURRENT_TEMPLATES, MARKUP_TEMPLATE)
+    templates = [
+        Template(f'{i}.tmpl', src, False) for i, src in enumerate(sources)
+    ]
+    ret = list(lint_pipelined(templates))
+    assert ret == [
+        (template, get_flakes(src))
+        for template, src in zip(templates, sources)
+    ]
+
+
+@pytest.mark.parametrize(
+    ('src', 'kwargs'),
+    (
+        ('#import foo\n', {'codes': frozenset(('T005',))}),
+        ('#implements respond\n#import foo\n', {'fail_fast': True}),
+    ),
+)
+def test_lint_pipelined_not_compiled(monkeypatch, src, kwargs):
+    expected = get_flakes(src, **kwargs)
+    monkeypatch.setattr(flake, 'compile_for_lint', _memory_error_to_py)
+    templates = [Template('a.tmpl', src, False)]
+    ret = list(lint_pipelined(templates, **kwargs))
+    assert ret == [(templates[0], expected)]
+
+
+def _memory_error_to_py(src):
+    raise MemoryError
+
+
+def test_lint_pipelined_memory_error(monkeypatch):
+    monkeypatch.setattr(flake, 'compile_for_lint', _memory_error_to_py)
+    templates = [Template('a.tmpl', '#import foo\n', False)]
+    expected = ((1, 'T007', 'Linting exceeded the memory limit'),)
+    assert get_flakes('#import foo\n') == expected
+    assert list(lint_pipelined(templates)) == [(templates[0], expected)]
+
+
+def _recording_phase(phases):
+    @contextlib.contextmanager
+    def phase(name):
+        phases.append(name)
+        yield
+    return phase
+
+
+def test_lint_pipelined_phases():
+    expected: list[str] = []
+    get_flakes('#import foo\n', phase=_recording_phase(expected))
+    phases: list[str] = []
+    templates = [Template('a.tmpl', '#import foo\n', False)]
+    list(lint_pipelined(templates, phase=_recording_phase(phases)))
+    assert phases == expected
+    assert {'to_py', 'check_flake8', 'normalize_lines'} <= set(phases)
+
+
+def test_lint_pipelined_cached(monkeypatch):
+    monkeypatch.setattr(flake, 'read_file', None)
+    cached = ((1, 'T005', 'File is empty'),)
+    template = Template('a.tmpl', None, True, 'key', cached)
+    assert list(lint_pipelined([template])) == [(template, cached)]
+
+
+def test_lint_pipelined_precompiled(precompiled, monkeypatch):
+    def compile_for_lint(src):
+        raise AssertionError('should not be compiled')
+
+    monkeypatch.setattr(flake, 'compile_for_lint', compile_for_lint)
+    templates = [Template('templates/foo.tmpl', None, True)]
+    ret = list(lint_pipelined(templates, precompiled_dir='build'))
+    assert [flakes for _, flakes in ret] == [
+        ((1, 'F401', "'foo' imported but unused"),),
+    ]
+
+
+def test_lint_pipelined_durations():
+    durations: dict[str, float] = {}
+    templates = [Template('a.tmpl', '#import foo\n', False)]
+    list(lint_pipelined(templates, durations=durations))
+    assert set(durations) == {'a.tmpl'}
+    assert durations['a.tmpl'] > 0
+
+
+def test_lint_pipelined_read_error():
+    with pytest.raises(FileNotFoundError):
+        list(lint_pipelined([Template('missing.tmpl', None, True)]))
+
+
+def test_main_pipeline(many_files, capsys):
+    assert main(many_files) == 1
+    expected, _ = capsys.readouterr()
+    assert main(['--pipeline', *many_files]) == 1
+    out, _ = capsys.readouterr()
+    assert out == expected
+
+
+def test_main_pipeline_fail_fast(two_bad_files, capsys):
+    assert main(['--pipeline', '--fail-fast', 'a.tmpl', 'b.tmpl']) == 1
+    out, _ = capsys.readouterr()
+    assert out == (
+        "a.tmpl:1 F401 'foo' imported but unused\n"
+        "a.tmpl:2 F401 'bar' imported but unused\n"
+    )
+
+
+@pytest.mark.parametrize(
+    'args',
+    (
+        ('--memory-report',),
+        ('--jobs', '2'),
+        ('--timeout', '1'),
+        ('--max-memory', '1000'),
+        ('--watch', '.'),
+    ),
+)
+def test_main_pipeline_invalid_options(args):
+    with pytest.raises(SystemExit):
+        main(['--pipeline', *args])
+
+
+@pytest.fixture
+def count_compiles(monkeypatch):
+    compiled = []
+
+    def counting_compile_for_lint(src):
+        compiled.append(src)
+        return compile_for_lint(src)
+
+    monkeypatch.setattr(flake, 'compile_for_lint', counting_compile_for_lint)
+    return compiled
+
+
+def test_get_flakes_compile_cache(tmpdir, count_compiles):
+    compile_cache = CompileCache(tmpdir.strpath, 1024 * 1024)
+    src = '#import foo\n#import bar\n$bar\n'
+    expected = get_flakes(src)
+    assert get_flakes(src, compile_cache=compile_cache) == expected
+    assert get_flakes(src, compile_cache=compile_cache) == expected
+    # with other checks, only those are run again
+    ret = get_flakes(
+        src, codes=frozenset(('F401', 'P001')), compile_cache=compile_cache,
+    )
+    assert ret == expected
+    assert len(count_compiles) == 2
+
+
+def test_get_flakes_limited_compile_cache(tmpdir, monkeypatch):
+    scans = []
+    entries = CompileCache._entries
+
+    def recording_entries(self):
+        scans.append(self)
+        return entries(self)
+
+    monkeypatch.setattr(CompileCache, '_entries', recording_entries)
+    compile_cache = CompileCache(tmpdir.strpath, 1024 * 1024)
+    for src in ('#import foo\n', '#import bar\n', '#import baz\n'):
+        get_flakes_limited(src, 10, compile_cache=compile_cache)
+        # compiled by the subprocess, stored here
+        assert compile_cache.get(src) == compile_for_lint(src)
+    # the size of the cache was found once
+    assert scans == [compile_cache]
+
+
+def test_lint_pipelined_compile_cache(tmpdir, count_compiles):
+    compile_cache = CompileCache(tmpdir.strpath, 1024 * 1024)
+    templates = [Template('a.tmpl', '#import foo\n', False)] * 2
+    ret = list(lint_pipelined(templates, compile_cache=compile_cache))
+    assert ret == [
+        (templates[0], ((1, 'F401', "'foo' imported but unused"),)),
+    ] * 2
+    assert len(count_compiles) == 1
+
+
+def test_main_compile_cache(tmpdir, capsys, count_compiles):
+    tmpdir.join('a.tmpl').write('#import foo\n')
+    args = [
+        '--compile-cache', tmpdir.join('cache').strpath,
+        '--compile-cache-size', '1', tmpdir.join('a.tmpl').strpath,
+    ]
+    assert main(args) == 1
+    expected, _ = capsys.readouterr()
+    assert main(['--select', 'F', *args]) == 1
+    out, _ = capsys.readouterr()
+    assert out == expected
+    assert len(count_compiles) == 1
+
+
+@pytest.fixture
+def baselined(tmpdir, capsys):
+    with tmpdir.as_cwd():
+        tmpdir.join('a.tmpl').write('#import foo\n#import bar\n')
+        tmpdir.join('b.tmpl').write('')
+        args = ['--baseline', 'baseline.json', 'a.tmpl', 'b.tmpl']
+        assert main(['--write-baseline', '--select', 'F,T', *args]) == 0
+        out, _ = capsys.readouterr()
+        assert out == ''
+        yield args
+
+
+def test_main_baseline_other_paths(baselined, tmpdir, capsys):
+    assert main(['--baseline', 'baseline.json', './a.tmpl', 'b.tmpl']) == 0
+    with tmpdir.join('sub').ensure_dir().as_cwd():
+        args = ['--baseline', '../baseline.json', '../a.tmpl', '../b.tmpl']
+        assert main(args) == 0
+    out, _ = capsys.readouterr()
+    assert out == ''
+
+
+def test_main_baseline_unchanged_not_linted(baselined, capsys, monkeypatch):
+    def lint_file(*args, **kwargs):
+        raise AssertionError('should not be linted')
+
+    monkeypatch.setattr(flake, 'lint_file', lint_file)
+    assert main(['--select', 'F401', *baselined]) == 0
+    assert main(['--pipeline', *baselined]) == 0
+    out, _ = capsys.readouterr()
+    assert out == ''
+
+
+def test_main_baseline_stdin(tmpdir, capsys, monkeypatch):
+    args = ['--baseline', 'baseline.json', '--stdin-filename', 'a.tmpl', '-']
+    with tmpdir.as_cwd():
+        _fake_stdin(monkeypatch, b'#import foo\n')
+        assert main(['--write-baseline', *args]) == 0
+        _fake_stdin(monkeypatch, b'#import foo\n')
+        assert main(args) == 0
+        _fake_stdin(monkeypatch, b'#import foo\n#import bar\n')
+        assert main(args) == 1
+    out, _ = capsys.readouterr()
+    assert out == "a.tmpl:2 F401 'bar' imported but unused\n"
+
+
+def test_main_baseline_reports_new_findings(tmpdir, baselined, capsys):
+    tmpdir.join('a.tmpl').write('#import baz\n#import bar\n#import foo\n')
+    assert main(['--count', *baselined]) == 1
+    out, _ = capsys.readouterr()
+    assert out == '1\n'
+    assert main(baselined) == 1
+    out, _ = capsys.readouterr()
+    assert out == "a.tmpl:1 F401 'baz' imported but unused\n"
+
+
+def test_main_baseline_new_codes_are_linted(baselined, monkeypatch):
+    linted = []
+    lint_file = flake.lint_file
+
+    def recording_lint_file(filename, *args, **kwargs):
+        linted.append(filename)
+        return lint_file(filename, *args, **kwargs)
+
+    monkeypatch.setattr(flake, 'lint_file', recording_lint_file)
+    # P001 was not enabled when the baseline was written
+    assert main(['--select', 'F401,P001', *baselined]) == 0
+    assert linted == ['a.tmpl', 'b.tmpl']
+
+
+def test_main_baseline_missing(tmpdir):
+    with tmpdir.as_cwd(), pytest.raises(SystemExit):
+        main(['--baseline', 'missing.json'])
+
+
+def test_main_baseline_invalid(tmpdir, capsys):
+    tmpdir.join('b.json').write('{"version": 1, "codes": []}')
+    with tmpdir.as_cwd(), pytest.raises(SystemExit):
+        main(['--baseline', 'b.json'])
+    _, err = capsys.readouterr()
+    assert err.endswith('error: --baseline: b.json: invalid baseline\n')
+
+
+@pytest.mark.parametrize(
+    'args',
+    (
+        ('--write-baseline',),
+        ('--baseline', 'b.json', '--watch', '.'),
+        ('--baseline', 'b.json', '--write-baseline', '--fail-fast'),
+        ('--baseline', 'b.json', '--write-baseline', '--shard', '1/2'),
+    ),
+)
+def test_main_baseline_invalid_options(args):
+    with pytest.raises(SystemExit):
+        main(args)
+
+
+REDEFINITION_TEMPLATE = '#import foo\n$foo.bar\n#import foo\n'
+REDEFINITION = (3, 'F811', "redefinition of unused 'foo' from line 1")
+
+
+@pytest.fixture
+def precompiled_redefinition(precompiled):
+    precompiled.join('templates/foo.tmpl').write(REDEFINITION_TEMPLATE)
+    precompiled.join('build/templates/foo.py').write(
+        compile_source(REDEFINITION_TEMPLATE),
+    )
+    mtime = os.path.getmtime('templates/foo.tmpl')
+    os.utime('build/templates/foo.py', (mtime + 10, mtime + 10))
+    yield precompiled
+
+
+@pytest.fixture
+def compiled(monkeypatch):
+    compiled = []
+
+    def compile_for_lint(src):
+        compiled.append(src)
+        return flake_compile_for_lint(src)
+
+    flake_compile_for_lint = flake.compile_for_lint
+    monkeypatch.setattr(flake, 'compile_for_lint', compile_for_lint)
+    yield compiled
+
+
+def test_precompiled_line_numbers_without_source_map():
+    py_lines = compile_source(REDEFINITION_TEMPLATE).splitlines(True)
+    data = flake.check_flake8(py_lines)
+    ret = flake.normalize_lines(
+        data, py_lines, REDEFINITION_TEMPLATE.splitlines(True),
+    )
+    # the similar first line is found instead
+    assert ret == ((1, *REDEFINITION[1:]),)
+
+
+def test_precompiled_exact_line_numbers(precompiled_redefinition, compiled):
+    # the module has no source map, F811 needs the template compiled after all
+    ret = flake.lint_file('templates/foo.tmpl', precompiled_dir='build')
+    assert ret == (REDEFINITION,)
+    assert compiled == [REDEFINITION_TEMPLATE]
+
+
+def test_lint_pipelined_precompiled_exact_line_numbers(
+        precompiled_redefinition, compiled,
+):
+    templates = [Template('templates/foo.tmpl', None, True)]
+    ret = list(lint_pipelined(templates, precompiled_dir='build'))
+    assert [flakes for _, flakes in ret] == [(REDEFINITION,)]
+    assert compiled == [REDEFINITION_TEMPLATE]
+
+
+def test_lint_pipelined_precompiled_memory_error(
+        precompiled_redefinition, monkeypatch,
+):
+    monkeypatch.setattr(flake, 'compile_for_lint', _memory_error_to_py)
+    templates = [Template('templates/foo.tmpl', None, True)]
+    ret = list(lint_pipelined(templates, precompiled_dir='build'))
+    assert [flakes for _, flakes in ret] == [
+        ((1, 'T007', 'Linting exceeded the memory limit'),),
+    ]
+
+
+def test_get_cached_keyed_by_precompiled_module(precompiled):
+    keys = []
+
+    class Cache(RemoteCache):
+        def __init__(self):
+            pass
+
+        def get_many(self, batch):
+            keys.extend(batch)
+            return {}
+
+    template = Template('templates/foo.tmpl', None, True)
+    for precompiled_dir in (None, 'build', 'build'):
+        list(get_cached([template], Cache(), (), precompiled_dir))
+    precompiled.join('build/templates/foo.py').write(
+        to_py('#import foo\n') + '\n',
+    )
+    list(get_cached([template], Cache(), (), 'build'))
+    assert keys[1] == keys[2]
+    assert len(set(keys)) == 3
+
+
+def test_main_baseline_with_precompiled():
+    with pytest.raises(SystemExit):
+        main(['--baseline', 'b.json', '--precompiled', 'build'])
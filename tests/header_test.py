@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import pytest
+
+from cheetah_lint.header import join_header
+from cheetah_lint.header import split_header
+
+
+@pytest.mark.parametrize(
+    ('s', 'expected'),
+    (
+        ('', ('', '')),
+        ('hello\n', ('', 'hello\n')),
+        ('#import a\n', ('#import a\n', '')),
+        ('#import a\n\n\nhello\n', ('#import a\n', '\n\nhello\n')),
+        (
+            '\n#extends a\n\n#from b import c, d\n#def e()\n#end def\n',
+            ('\n#extends a\n\n#from b import c, d\n', '#def e()\n#end def\n'),
+        ),
+        (
+            '#compiler-settings\n'
+            'useLegacyImportMode = False\n'
+            '#end compiler-settings\n'
+            '#implements respond\n'
+            '$foo\n',
+            (
+                '#compiler-settings\n'
+                'useLegacyImportMode = False\n'
+                '#end compiler-settings\n'
+                '#implements respond\n',
+                '$foo\n',
+            ),
+        ),
+        ('\n\n', ('', '\n\n')),
+    ),
+)
+def test_split_header(s, expected):
+    assert split_header(s) == expected
+
+
+@pytest.mark.parametrize(
+    's',
+    (
+        # directives after the header are also moved by the reordering
+        '#import a\nhello\n#import b\n',
+        '#import a\n#def f()\n    #from b import c\n#end def\n',
+        # unusual forms of directives are not handled
+        '#import a ## comment\n#import b\n',
+        '#import a#\n',
+        '#import a  \r\n',
+        '#import a',
+        '#compiler-settings\n# comment\n#end compiler-settings\n',
+        # directives continued on the next line
+        '#from a import (b,\n    c)\n\nhello $b\n',
+        '#import a\\\n\n',
+        '#import a, \\\n    b\nhello\n',
+    ),
+)
+def test_split_header_needs_full_parse(s):
+    assert split_header(s) is None
+
+
+@pytest.mark.parametrize(
+    ('header', 'body', 'expected'),
+    (
+        ('#import a\n', '', '#import a\n'),
+        ('#import a\n', '\n\n', '#import a\n'),
+        ('#import a\n', 'hello', '#import a\n\n\nhello\n'),
+        ('#import a\n\n', '\nhello\n\n\n', '#import a\n\n\nhello\n'),
+    ),
+)
+def test_join_header(header, body, expected):
+    assert join_header(header, body) == expected
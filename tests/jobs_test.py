@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import argparse
+import contextlib
+import threading
+import time
+from typing import Generator
+
+import pytest
+
+from cheetah_lint.jobs import map_in_order
+from cheetah_lint.jobs import pipeline
+from cheetah_lint.jobs import positive_int
+
+
+def test_positive_int():
+    assert positive_int('4') == 4
+
+
+@pytest.mark.parametrize('s', ('', 'a', '0', '-1'))
+def test_positive_int_invalid(s):
+    with pytest.raises(argparse.ArgumentTypeError):
+        positive_int(s)
+
+
+def _sleep_and_return(x):
+    time.sleep(x)
+    return x
+
+
+class _Concurrency:
+    """Records the most calls running at once."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._running = 0
+        self.most = 0
+
+    @contextlib.contextmanager
+    def call(self) -> Generator[None, None, None]:
+        with self._lock:
+            self._running += 1
+            self.most = max(self.most, self._running)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._running -= 1
+
+
+@pytest.mark.parametrize('jobs', (1, 4))
+def test_map_in_order_keeps_order(jobs):
+    # the later items finish first when run concurrently
+    items = [.2, .1, 0, .05]
+    assert list(map_in_order(_sleep_and_return, items, jobs)) == items
+
+
+def test_map_in_order_serial_is_lazy():
+    called: list[int] = []
+    gen = map_in_order(called.append, [1, 2, 3])
+    next(gen)
+    assert called == [1]
+
+
+def test_map_in_order_close_cancels_pending():
+    called = []
+
+    def func(x):
+        called.append(x)
+        return _sleep_and_return(.05)
+
+    gen = map_in_order(func, range(10), jobs=2)
+    next(gen)
+    gen.close()
+    # only the items already running when it was closed are finished
+    assert len(called) < 10
+
+
+def test_map_in_order_reads_items_as_needed():
+    read: list[None] = []
+
+    def items():
+        while True:
+            read.append(None)
+            yield .01
+
+    gen = map_in_order(_sleep_and_return, items(), jobs=2)
+    next(gen)
+    # only a few items ahead of the results are scheduled
+    assert len(read) <= 5
+    gen.close()
+
+
+def test_map_in_order_scales_with_jobs():
+    # each call waits for all of them to be running
+    barrier = threading.Barrier(8, timeout=10)
+
+    def func(x):
+        barrier.wait()
+        return x
+
+    assert list(map_in_order(func, range(8), jobs=8)) == list(range(8))
+
+
+def test_pipeline_keeps_order():
+    stages = (lambda x: x * 2, _sleep_and_return, lambda x: x + 1)
+    items = [.1, 0, .05, 0]
+    assert list(pipeline(items, stages)) == [1.2, 1, 1.1, 1]
+
+
+def test_pipeline_overlaps_stages():
+    concurrency = _Concurrency()
+
+    def stage(x):
+        with concurrency.call():
+            return _sleep_and_return(x)
+
+    assert list(pipeline([.05] * 8, (stage,) * 4)) == [.05] * 8
+    assert concurrency.most > 1
+
+
+def test_pipeline_queues_are_bounded():
+    started = []
+
+    def first(x):
+        started.append(x)
+        return x
+
+    gen = pipeline(range(100), (first, lambda x: x), maxsize=2)
+    assert next(gen) == 0
+    time.sleep(.1)
+    # the stages only run a few items ahead of the consumer
+    assert len(started) < 10
+    gen.close()
+
+
+def test_pipeline_raises_in_order():
+    def fail_on_2(x):
+        if x == 2:
+            raise ValueError(x)
+        return x
+
+    gen = pipeline(range(5), (lambda x: x, fail_on_2))
+    assert next(gen) == 0
+    assert next(gen) == 1
+    with pytest.raises(ValueError):
+        next(gen)
+
+
+def test_pipeline_raises_from_items():
+    def items():
+        yield 1
+        raise ValueError('bad input')
+
+    gen = pipeline(items(), (lambda x: x,))
+    assert next(gen) == 1
+    with pytest.raises(ValueError):
+        next(gen)
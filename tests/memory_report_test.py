@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import sys
+
+import lxml.etree
+import pytest
+
+from cheetah_lint import memory_report
+from cheetah_lint.memory_report import FileMemory
+from cheetah_lint.memory_report import format_size
+from cheetah_lint.memory_report import get_rss
+from cheetah_lint.memory_report import MemoryReport
+from cheetah_lint.memory_report import PhaseMemory
+
+
+@pytest.mark.parametrize(
+    ('size', 'expected'),
+    (
+        (0, '0B'),
+        (1023, '1023B'),
+        (2048, '2KiB'),
+        (3 * 1024 * 1024, '3MiB'),
+        (5 * 1024 * 1024 * 1024, '5GiB'),
+        (-2048, '-2KiB'),
+    ),
+)
+def test_format_size(size, expected):
+    assert format_size(size) == expected
+
+
+def test_memory_report_records_phases():
+    with MemoryReport() as report:
+        with report.file('f.tmpl'):
+            with report.phase('allocate'):
+                kept = [object() for _ in range(10000)]
+            with report.phase('temporary'):
+                [object() for _ in range(10000)]
+
+    (_, _, kept_peak, kept_retained, _), (_, _, tmp_peak, tmp_retained, _) = (
+        report.phases
+    )
+    assert [p.phase for p in report.phases] == ['allocate', 'temporary']
+    assert {p.filename for p in report.phases} == {'f.tmpl'}
+    assert kept_retained > 10000 * 16
+    if sys.version_info >= (3, 9):  # pragma: >=3.9 cover
+        assert kept_peak is not None and tmp_peak is not None
+        assert kept_peak >= kept_retained
+        assert tmp_peak > 10000 * 16
+        assert tmp_retained < tmp_peak
+    else:  # pragma: <3.9 cover
+        assert kept_peak is None and tmp_peak is None
+    file_memory, = report.files
+    assert file_memory.filename == 'f.tmpl'
+    assert file_memory.retained >= kept_retained
+    del kept
+
+
+def test_get_rss():
+    rss = get_rss()
+    assert rss is not None and rss > 0
+
+
+def test_get_rss_without_proc(monkeypatch):
+    monkeypatch.setattr(memory_report, 'STATM', '/does/not/exist')
+    rss = get_rss()
+    assert rss is not None and rss > 0
+
+
+def test_memory_report_records_c_allocations():
+    with MemoryReport() as report:
+        with report.file('f.tmpl'):
+            with report.phase('parse'):
+                doc = lxml.etree.fromstring('<a>' + '<b/>' * 200000 + '</a>')
+
+    phase_memory, = report.phases
+    # libxml2's memory is only seen in the resident set size
+    assert phase_memory.retained < 1024 * 1024
+    assert phase_memory.rss is not None
+    assert phase_memory.rss > 8 * 1024 * 1024
+    file_memory, = report.files
+    assert file_memory.rss is not None
+    assert file_memory.rss > 8 * 1024 * 1024
+    del doc
+
+
+def test_memory_report_format():
+    report = MemoryReport()
+    report.phases = [
+        PhaseMemory('a.tmpl', 'to_py', 2048, 0),
+        PhaseMemory('b.tmpl', 'to_py', 4096, 1024),
+    ]
+    report.files = [FileMemory('a.tmpl', 1024), FileMemory('b.tmpl', 1024)]
+    assert report.format(top=1) == (
+        'Top 1 phases by peak memory:\n'
+        '  b.tmpl to_py: peak 4KiB, retained 1KiB\n'
+        'Top 1 files by memory retained after processing:\n'
+        '  a.tmpl: 1KiB\n'
+        'Memory returns to baseline between files (python allocations).'
+    )
+
+
+def test_memory_report_format_growth():
+    report = MemoryReport()
+    report.files = [FileMemory('a.tmpl', 1024), FileMemory('b.tmpl', 5120)]
+    assert report.format().endswith(
+        'Memory does not return to baseline between files: '
+        'python allocations grew 4KiB after the first file.',
+    )
+
+
+def test_memory_report_format_rss():
+    report = MemoryReport()
+    report.phases = [
+        PhaseMemory('a.tmpl', 'parse', 2048, 0, 8192),
+        PhaseMemory('b.tmpl', 'parse', 4096, 1024, 0),
+    ]
+    report.files = [
+        FileMemory('a.tmpl', 1024, 8192),
+        FileMemory('b.tmpl', 1024, 40960),
+    ]
+    assert report.format(top=1) == (
+        'Top 1 phases by peak memory:\n'
+        '  b.tmpl parse: peak 4KiB, retained 1KiB, rss 0B\n'
+        'Top 1 phases by resident set size growth:\n'
+        '  a.tmpl parse: 8KiB\n'
+        'Top 1 files by memory retained after processing:\n'
+        '  b.tmpl: 1KiB, rss 40KiB\n'
+        # the python allocations returned to baseline, the process did not
+        'Memory does not return to baseline between files: '
+        'resident set size grew 32KiB after the first file.'
+    )
+
+
+def test_memory_report_format_without_peaks():
+    report = MemoryReport()
+    report.phases = [
+        PhaseMemory('a.tmpl', 'to_py', None, 2048),
+        PhaseMemory('b.tmpl', 'to_py', None, 1024),
+    ]
+    report.files = [FileMemory('a.tmpl', 1024)]
+    assert report.format(top=1) == (
+        'Peak memory per phase is unavailable (needs python 3.9+).\n'
+        'Top 1 phases by memory retained:\n'
+        '  a.tmpl to_py: retained 2KiB\n'
+        'Top 1 files by memory retained after processing:\n'
+        '  a.tmpl: 1KiB\n'
+        'Memory returns to baseline between files (python allocations).'
+    )
+
+
+def test_memory_report_without_rss(monkeypatch):
+    monkeypatch.setattr(memory_report, 'get_rss', lambda: None)
+    with MemoryReport() as report:
+        with report.file('f.tmpl'):
+            with report.phase('parse'):
+                pass
+    (_, _, _, _, phase_rss), = report.phases
+    (_, _, file_rss), = report.files
+    assert phase_rss is None and file_rss is None
+    assert 'resident set size' not in report.format()
+
+
+def test_memory_report_format_empty():
+    assert MemoryReport().format() == (
+        'Top 10 phases by peak memory:\n'
+        'Top 10 files by memory retained after processing:'
+    )
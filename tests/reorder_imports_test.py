@@ -1,12 +1,18 @@
 from __future__ import annotations
 
+import concurrent.futures
+import itertools
 import os.path
 
 import pytest
 
+from cheetah_lint import reorder_imports
+from cheetah_lint.reorder_imports import apply_steps
 from cheetah_lint.reorder_imports import main
+from cheetah_lint.reorder_imports import needs_reordering
 from cheetah_lint.reorder_imports import perform_step
 from cheetah_lint.reorder_imports import STEPS
+from cheetah_lint.shard import load_durations
 from cheetah_lint.util import read_file
 
 
@@ -35,6 +41,71 @@ def test_integration_template(template):
     assert expected == contents
 
 
+@pytest.mark.parametrize('template', TESTS)
+def test_integration_apply_steps(template):
+    contents, expected = get_input_output(template)
+    assert apply_steps(contents) == expected
+
+
+def _perform_all_steps(contents):
+    for step in STEPS:
+        contents = perform_step(contents, step)
+    return contents
+
+
+HEADERS = (
+    '#import b\n#import a\n',
+    '#extends foo\n',
+    '#implements respond\n',
+    '#extends foo\n#implements respond\n#import a\n',
+    '#compiler-settings\n'
+    'useLegacyImportMode = False\n'
+    '#end compiler-settings\n'
+    '#import sys\n'
+    '#import os\n',
+    '#compiler-settings\n'
+    'useLegacyImportMode = False\n'
+    '#end compiler-settings\n',
+    '\n#from a import c, b\n\n#import a\n#import a\n',
+    '#import a\n\n\n#extends x\n',
+    '#import b  \n#import a\n',
+    '#from a import (b,\n    c)\n',
+    '#import b, \\\n    a\n',
+)
+BODIES = (
+    '', '\n', '\n\n\n', 'hello', 'hello\n\n', '\nhello\n', '  x\n', '\t\n',
+    ' \n\nx', '$foo\n', '\n$foo\n', '#def x()\n#end def\n',
+    '\n\n#def x()\n#end def\n', '#py x = 1\n', '## comment\n', '#* c *#\n',
+)
+
+
+@pytest.mark.parametrize(
+    ('header', 'body'), tuple(itertools.product(HEADERS, BODIES)),
+)
+def test_apply_steps_header_only_matches_full_parse(header, body):
+    assert apply_steps(header + body) == _perform_all_steps(header + body)
+
+
+def test_apply_steps_only_parses_header(monkeypatch):
+    parsed = []
+    parse = reorder_imports.parse
+
+    def recording_parse(s):
+        parsed.append(s)
+        return parse(s)
+
+    monkeypatch.setattr(reorder_imports, 'parse', recording_parse)
+    body = '<div>$foo</div>\n' * 100
+    ret = apply_steps('#import b\n#import a\n' + body)
+    assert ret == '#import a\n#import b\n\n\n' + body
+    assert all('<div>' not in s for s in parsed)
+
+
+def test_apply_steps_falls_back_to_full_parse():
+    contents = '#import b\nhello\n#import a\n'
+    assert apply_steps(contents) == _perform_all_steps(contents)
+
+
 @pytest.mark.parametrize('template', TESTS)
 def test_integration_calls_main(tmpdir, template):
     contents, expected = get_input_output(template)
@@ -47,3 +118,197 @@ def test_integration_calls_main(tmpdir, template):
 
     end_contents = read_file(template_path)
     assert expected == end_contents
+
+
+def test_main_memory_report(tmpdir, capsys):
+    template = tmpdir.join('tmp.tmpl')
+    template.write('#import foo, bar\n\nHello world\n')
+    assert main(['--memory-report', template.strpath]) == 1
+    out, err = capsys.readouterr()
+    assert out == f'Reordered imports in {template.strpath}\n'
+    assert f'{template.strpath} parse: peak ' in err
+    assert f'{template.strpath} separate_comma_imports: peak ' in err
+    assert f'{template.strpath} fix_whitespace_after_imports: peak ' in err
+
+
+def test_main_shard_and_durations(tmpdir, capsys):
+    with tmpdir.as_cwd():
+        tmpdir.join('a.tmpl').write('#import b\n#import a\n')
+        tmpdir.join('b.tmpl').write('#import b\n#import a\n\n' + 'x' * 100)
+        args = ['--shard', '1/2', '--durations', 'd.json', 'a.tmpl', 'b.tmpl']
+        assert main(args) == 1
+        assert set(load_durations('d.json')) == {'b.tmpl'}
+        assert read_file('a.tmpl') == '#import b\n#import a\n'
+
+    out, _ = capsys.readouterr()
+    assert out == 'Reordered imports in b.tmpl\n'
+
+
+def test_main_durations_invalid(tmpdir, capsys):
+    tmpdir.join('d.json').write('{')
+    tmpdir.join('a.tmpl').write('#import a\n')
+    with tmpdir.as_cwd(), pytest.raises(SystemExit):
+        main(['--durations', 'd.json', 'a.tmpl'])
+    _, err = capsys.readouterr()
+    assert 'error: --durations: ' in err
+
+
+@pytest.mark.parametrize('template', TESTS)
+def test_needs_reordering(template):
+    contents, expected = get_input_output(template)
+    assert needs_reordering(contents) is (contents != expected)
+    assert needs_reordering(expected) is False
+
+
+@pytest.mark.parametrize(
+    'contents',
+    (
+        '#import b\n#import a\n\nhello\n',
+        '#import a, b\n\nhello\n',
+        '#import a\n#import a\n\nhello\n',
+        '#import b\nhello\n#import a\n',
+    ),
+)
+def test_needs_reordering_returns_early(contents, monkeypatch):
+    def apply_steps(contents):
+        raise AssertionError('unreachable')
+    monkeypatch.setattr(reorder_imports, 'apply_steps', apply_steps)
+    assert needs_reordering(contents) is True
+
+
+@pytest.mark.parametrize(
+    ('header', 'body'), tuple(itertools.product(HEADERS, BODIES)),
+)
+def test_needs_reordering_matches_apply_steps(header, body):
+    contents = header + body
+    expected = apply_steps(contents) != contents
+    assert needs_reordering(contents) is expected
+
+
+@pytest.mark.parametrize(
+    ('header', 'body'), tuple(itertools.product(HEADERS, BODIES)),
+)
+def test_needs_reordering_matches_apply_steps_reordered(header, body):
+    # imports in order: only the directive placement / whitespace can differ
+    contents = apply_steps(header + body)
+    assert needs_reordering(contents) is False
+    for changed in (
+            contents.replace('\n\n\n', '\n\n', 1),
+            contents.replace('\n', '\n\n', 1),
+            contents + '\n',
+    ):
+        expected = apply_steps(changed) != changed
+        assert needs_reordering(changed) is expected
+
+
+@pytest.mark.parametrize(
+    'contents',
+    (
+        '#import a\n#import b\n\n\nhello\n',
+        '#extends foo\n#implements respond\n\n#import os\n\n#import a\n',
+        '#import os\n\n\n<div>$x</div>\n#def f()\n    #import re\n#end def\n',
+    ),
+)
+def test_needs_reordering_in_order_parses_once(contents, monkeypatch):
+    parsed = []
+    parse = reorder_imports.parse
+
+    def recording_parse(s):
+        parsed.append(s)
+        return parse(s)
+
+    def apply_steps(contents):
+        raise AssertionError('unreachable')
+
+    monkeypatch.setattr(reorder_imports, 'parse', recording_parse)
+    monkeypatch.setattr(reorder_imports, 'apply_steps', apply_steps)
+    assert needs_reordering(contents) is False
+    assert len(parsed) == 1
+
+
+def test_needs_reordering_unusual_directives():
+    # a second #extends stays in place, the steps decide
+    contents = '#import a\n#extends x\n#extends y\n'
+    expected = apply_steps(contents) != contents
+    assert needs_reordering(contents) is expected
+
+
+def test_main_check(tmpdir, capsys):
+    template = tmpdir.join('tmp.tmpl')
+    template.write('#import b\n#import a\n')
+    assert main(['--check', template.strpath]) == 1
+    assert template.read() == '#import b\n#import a\n'
+    out, _ = capsys.readouterr()
+    assert out == f'Imports need reordering in {template.strpath}\n'
+
+
+def test_main_check_ok(tmpdir, capsys):
+    template = tmpdir.join('tmp.tmpl')
+    template.write('#import a\n#import b\n')
+    assert main(['--check', template.strpath]) == 0
+    out, _ = capsys.readouterr()
+    assert out == ''
+
+
+@pytest.mark.parametrize('args', (['--diff'], ['--check', '--diff']))
+def test_main_diff(tmpdir, capsys, args):
+    template = tmpdir.join('tmp.tmpl')
+    template.write('#import b\n#import a\n')
+    assert main([*args, template.strpath]) == 1
+    assert template.read() == '#import b\n#import a\n'
+    out, _ = capsys.readouterr()
+    assert out == (
+        f'--- {template.strpath}\n'
+        f'+++ {template.strpath}\n'
+        f'@@ -1,2 +1,2 @@\n'
+        f'+#import a\n'
+        f' #import b\n'
+        f'-#import a\n'
+    )
+
+
+def test_main_diff_no_changes(tmpdir, capsys):
+    template = tmpdir.join('tmp.tmpl')
+    template.write('#import a\n#import b\n')
+    assert main(['--diff', template.strpath]) == 0
+    out, _ = capsys.readouterr()
+    assert out == ''
+
+
+def test_apply_steps_concurrent_matches_serial():
+    templates = [
+        header + body for header, body in itertools.product(HEADERS, BODIES)
+    ] + [get_input_output(template)[0] for template in TESTS]
+    expected = [apply_steps(template) for template in templates]
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        for _ in range(3):
+            assert list(executor.map(apply_steps, templates)) == expected
+
+
+def test_main_jobs(tmpdir, capsys):
+    filenames = []
+    for i in range(8):
+        template = tmpdir.join(f'{i}.tmpl')
+        template.write(f'#import b{i}\n#import a{i}\n')
+        filenames.append(template.strpath)
+    assert main(['--jobs', '4', '--diff', *filenames]) == 1
+    out, _ = capsys.readouterr()
+    assert out == ''.join(
+        f'--- {filename}\n'
+        f'+++ {filename}\n'
+        f'@@ -1,2 +1,2 @@\n'
+        f'+#import a{i}\n'
+        f' #import b{i}\n'
+        f'-#import a{i}\n'
+        for i, filename in enumerate(filenames)
+    )
+    assert main(['--jobs', '4', *filenames]) == 1
+    assert all(
+        tmpdir.join(f'{i}.tmpl').read() == f'#import a{i}\n#import b{i}\n'
+        for i in range(8)
+    )
+
+
+def test_main_memory_report_with_jobs():
+    with pytest.raises(SystemExit):
+        main(['--memory-report', '--jobs', '2'])
@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import argparse
+import json
+
+import pytest
+
+from cheetah_lint.shard import get_costs
+from cheetah_lint.shard import get_shard
+from cheetah_lint.shard import load_durations
+from cheetah_lint.shard import order_by_cost
+from cheetah_lint.shard import parse_shard
+from cheetah_lint.shard import record_duration
+from cheetah_lint.shard import save_durations
+from cheetah_lint.shard import select_files
+
+
+def test_parse_shard():
+    assert parse_shard('2/3') == (2, 3)
+
+
+@pytest.mark.parametrize('s', ('', '1', '1/2/3', 'a/b', '0/3', '4/3'))
+def test_parse_shard_invalid(s):
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_shard(s)
+
+
+def test_load_durations_none():
+    assert load_durations(None) == {}
+
+
+def test_load_durations_missing(tmpdir):
+    assert load_durations(tmpdir.join('durations.json').strpath) == {}
+
+
+@pytest.mark.parametrize(
+    'contents', ('{', '[]', '{"a.tmpl": "1"}', '{"a.tmpl": null}'),
+)
+def test_load_durations_invalid(tmpdir, contents):
+    durations_file = tmpdir.join('durations.json')
+    durations_file.write(contents)
+    with pytest.raises(ValueError):
+        load_durations(durations_file.strpath)
+
+
+def test_save_durations_merges(tmpdir):
+    durations_file = tmpdir.join('durations.json')
+    durations_file.write(json.dumps({'a.tmpl': 1., 'b.tmpl': 2.}))
+    save_durations(durations_file.strpath, {'b.tmpl': 3., 'c.tmpl': 4.})
+    assert load_durations(durations_file.strpath) == {
+        'a.tmpl': 1., 'b.tmpl': 3., 'c.tmpl': 4.,
+    }
+
+
+def test_record_duration():
+    durations: dict[str, float] = {}
+    with record_duration(durations, 'a.tmpl'):
+        pass
+    assert durations['a.tmpl'] >= 0
+
+
+@pytest.fixture
+def files(tmpdir):
+    with tmpdir.as_cwd():
+        for name, size in (('a', 100), ('b', 300), ('c', 200), ('d', 0)):
+            tmpdir.join(f'{name}.tmpl').write('x' * size)
+        yield tmpdir
+
+
+def test_get_costs_by_size(files):
+    costs = get_costs(['a.tmpl', 'b.tmpl', 'd.tmpl', 'missing.tmpl'], {})
+    assert costs == {
+        'a.tmpl': 100., 'b.tmpl': 300., 'd.tmpl': 1., 'missing.tmpl': 1.,
+    }
+
+
+def test_get_costs_scales_sizes_by_durations(files):
+    costs = get_costs(['a.tmpl', 'b.tmpl', 'c.tmpl'], {'a.tmpl': 2.})
+    assert costs == {'a.tmpl': 2., 'b.tmpl': 6., 'c.tmpl': 4.}
+
+
+def test_order_by_cost():
+    costs = {'a': 1., 'b': 3., 'c': 3., 'd': 2.}
+    assert order_by_cost(['a', 'b', 'c', 'd'], costs) == ['b', 'c', 'd', 'a']
+
+
+def test_get_shard_balances_cost():
+    costs = {'a': 10., 'b': 6., 'c': 5., 'd': 4., 'e': 1.}
+    filenames = list(costs)
+    shards = [get_shard(filenames, i, 2, costs) for i in (1, 2)]
+    assert shards == [['a', 'd'], ['b', 'c', 'e']]
+
+
+def test_get_shard_is_a_partition():
+    costs = {f'{i}.tmpl': float(i % 7) for i in range(50)}
+    shards = [get_shard(list(costs), i, 4, costs) for i in (1, 2, 3, 4)]
+    assert sorted(f for shard in shards for f in shard) == sorted(costs)
+    # independent of the order the files are discovered in
+    assert shards == [
+        get_shard(list(reversed(list(costs))), i, 4, costs)
+        for i in (1, 2, 3, 4)
+    ]
+
+
+def test_select_files_no_shard():
+    assert select_files(['b.tmpl', 'a.tmpl'], None, None) == [
+        'b.tmpl', 'a.tmpl',
+    ]
+
+
+def test_select_files_ordered_by_cost(files):
+    durations_file = files.join('durations.json')
+    durations_file.write(json.dumps({'a.tmpl': 5., 'b.tmpl': 1.}))
+    filenames = ['c.tmpl', 'a.tmpl', 'b.tmpl']
+    # by size with several jobs
+    assert select_files(filenames, None, None, jobs=2) == [
+        'b.tmpl', 'c.tmpl', 'a.tmpl',
+    ]
+    # by the recorded durations (and the sizes scaled by them)
+    assert select_files(filenames, None, durations_file.strpath) == [
+        'a.tmpl', 'c.tmpl', 'b.tmpl',
+    ]
+
+
+def test_select_files_shard(files):
+    durations_file = files.join('durations.json')
+    durations_file.write(json.dumps({'a.tmpl': 5.}))
+    filenames = ['a.tmpl', 'b.tmpl', 'c.tmpl']
+    shards = [
+        select_files(filenames, (i, 2), durations_file.strpath)
+        for i in (1, 2)
+    ]
+    assert shards == [['b.tmpl'], ['c.tmpl', 'a.tmpl']]
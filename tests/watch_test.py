@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import ctypes
+import sys
+
+import pytest
+
+from cheetah_lint import watch as watch_mod
+from cheetah_lint.flake import main
+from cheetah_lint.watch import find_templates
+from cheetah_lint.watch import get_watcher
+from cheetah_lint.watch import IN_Q_OVERFLOW
+from cheetah_lint.watch import INOTIFY_EVENT
+from cheetah_lint.watch import InotifyWatcher
+from cheetah_lint.watch import PollingWatcher
+from cheetah_lint.watch import watch
+
+
+@pytest.fixture
+def tree(tmpdir):
+    tmpdir.join('a.tmpl').write('a')
+    tmpdir.join('sub/b.tmpl').write('b', ensure=True)
+    tmpdir.join('sub/c.txt').write('c')
+    with tmpdir.as_cwd():
+        yield tmpdir
+
+
+def _polling_watcher(paths):
+    return PollingWatcher(paths, interval=.01)
+
+
+def _inotify_watcher(paths):
+    if sys.platform != 'linux':  # pragma: linux no cover
+        pytest.skip('inotify is only available on linux')
+    return InotifyWatcher(paths)
+
+
+@pytest.fixture(params=(_polling_watcher, _inotify_watcher))
+def make_watcher(request):
+    watchers = []
+
+    def make(paths):
+        watcher = request.param(paths)
+        watchers.append(watcher)
+        return watcher
+
+    yield make
+    for watcher in watchers:
+        if isinstance(watcher, InotifyWatcher):
+            watcher.close()
+
+
+def test_find_templates(tree):
+    ret = find_templates(('.', 'other.tmpl'))
+    assert ret == ['./a.tmpl', './sub/b.tmpl', 'other.tmpl']
+
+
+def test_watcher_nothing_changed(tree, make_watcher):
+    assert make_watcher(('.',)).wait(timeout=.05) == set()
+
+
+def test_watcher_modified(tree, make_watcher):
+    watcher = make_watcher(('.',))
+    tree.join('sub/b.tmpl').write('bb')
+    assert watcher.wait(timeout=5) == {'./sub/b.tmpl'}
+    assert watcher.wait(timeout=.05) == set()
+
+
+def test_watcher_coalesces_changes(tree, make_watcher):
+    watcher = make_watcher(('.',))
+    tree.join('a.tmpl').write('aa')
+    tree.join('sub/b.tmpl').write('bb')
+    tree.join('sub/c.txt').write('cc')
+    assert watcher.wait(timeout=5) == {'./a.tmpl', './sub/b.tmpl'}
+
+
+def test_watcher_new_file_in_new_directory(tree, make_watcher):
+    watcher = make_watcher(('.',))
+    tree.join('new/d.tmpl').write('d', ensure=True)
+    assert watcher.wait(timeout=5) == {'./new/d.tmpl'}
+
+
+def test_watcher_only_given_files(tree, make_watcher):
+    watcher = make_watcher(('a.tmpl',))
+    tree.join('sub/b.tmpl').write('bb')
+    tree.join('new/d.tmpl').write('d', ensure=True)
+    tree.join('a.tmpl').write('aa')
+    assert watcher.wait(timeout=5) == {'a.tmpl'}
+
+
+def test_watcher_file_created(tree, make_watcher):
+    watcher = make_watcher(('new.tmpl',))
+    tree.join('new.tmpl').write('new')
+    assert watcher.wait(timeout=5) == {'new.tmpl'}
+
+
+def test_watcher_without_timeout(tree, make_watcher):
+    watcher = make_watcher(('.',))
+    tree.join('a.tmpl').write('aa')
+    assert watcher.wait() == {'./a.tmpl'}
+
+
+def test_watcher_changes_while_waiting_for_more(tree, make_watcher):
+    watcher = make_watcher(('.',))
+    name = '_read' if isinstance(watcher, InotifyWatcher) else '_changed'
+    get_changes = getattr(watcher, name)
+
+    def changes(*args):
+        ret = get_changes(*args)
+        if ret == {'./a.tmpl'}:
+            # another template is saved before the delay is over
+            tree.join('sub/b.tmpl').write('bb')
+        return ret
+
+    setattr(watcher, name, changes)
+    tree.join('a.tmpl').write('aa')
+    assert watcher.wait(timeout=5) == {'./a.tmpl', './sub/b.tmpl'}
+
+
+def test_get_watcher(tree):
+    watcher = get_watcher(('.',))
+    try:
+        if sys.platform == 'linux':  # pragma: linux cover
+            assert isinstance(watcher, InotifyWatcher)
+        else:  # pragma: linux no cover
+            assert isinstance(watcher, PollingWatcher)
+    finally:
+        if isinstance(watcher, InotifyWatcher):  # pragma: linux cover
+            watcher.close()
+
+
+def test_watch(tree, monkeypatch):
+    monkeypatch.setattr(watch_mod, 'get_watcher', _polling_watcher)
+    seen = []
+
+    def callback(filename):
+        seen.append(filename)
+        if len(seen) == 2:
+            # simulate saving a file while watching
+            tree.join('a.tmpl').write('aa')
+        elif len(seen) == 3:
+            tree.join('sub/b.tmpl').write('bb')
+        elif len(seen) == 4:
+            raise KeyboardInterrupt
+
+    assert watch(('.',), callback) == 0
+    assert seen == ['./a.tmpl', './sub/b.tmpl', './a.tmpl', './sub/b.tmpl']
+
+
+def test_main_watch(tree, capsys):
+    tree.join('a.tmpl').write('#import foo\n')
+
+    def wait(self, timeout=None, delay=.05):
+        raise KeyboardInterrupt
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(PollingWatcher, 'wait', wait)
+        mp.setattr(InotifyWatcher, 'wait', wait)
+        assert main(['--watch', '.']) == 0
+
+    out, _ = capsys.readouterr()
+    assert out == "./a.tmpl:1 F401 'foo' imported but unused\n"
+
+
+def test_main_watch_memory_report():
+    with pytest.raises(SystemExit):
+        main(['--watch', '.', '--memory-report'])
+
+
+def test_inotify_watcher_overflow(tree):
+    watcher = _inotify_watcher(('.', 'other.tmpl'))
+    try:
+        overflow = INOTIFY_EVENT.pack(-1, IN_Q_OVERFLOW, 0, 0)
+        assert watcher._handle_events(overflow) == {
+            './a.tmpl', './sub/b.tmpl', 'other.tmpl',
+        }
+    finally:
+        watcher.close()
+
+
+def test_watch_reports_errors(tree, monkeypatch, capsys):
+    monkeypatch.setattr(watch_mod, 'get_watcher', _polling_watcher)
+    seen = []
+
+    def callback(filename):
+        seen.append(filename)
+        if len(seen) == 1:
+            tree.join('sub/b.tmpl').write('bb')
+            raise ValueError('does not parse')
+        elif len(seen) == 3:
+            raise KeyboardInterrupt
+
+    assert watch(('.',), callback) == 0
+    assert seen == ['./a.tmpl', './sub/b.tmpl', './sub/b.tmpl']
+    _, err = capsys.readouterr()
+    assert err == './a.tmpl: ValueError: does not parse\n'
+
+
+def test_main_watch_parse_error(tree, capsys):
+    tree.join('a.tmpl').write('#if x\nfoo\n')
+    tree.join('sub/b.tmpl').write('#import foo\n')
+
+    def wait(self, timeout=None, delay=.05):
+        raise KeyboardInterrupt
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(PollingWatcher, 'wait', wait)
+        mp.setattr(InotifyWatcher, 'wait', wait)
+        assert main(['--watch', '.']) == 0
+
+    out, err = capsys.readouterr()
+    # the other templates are still linted
+    assert out == "./sub/b.tmpl:1 F401 'foo' imported but unused\n"
+    assert err.startswith('./a.tmpl: ParseError: ')
+
+
+def test_inotify_watcher_missing_directory(tree):
+    with pytest.raises(OSError):
+        _inotify_watcher(('missing/a.tmpl',))
+
+
+def test_get_watcher_missing_directory(tree):
+    assert isinstance(get_watcher(('missing/a.tmpl',)), PollingWatcher)
+
+
+def test_inotify_watcher_init_fails(monkeypatch):
+    if sys.platform != 'linux':  # pragma: linux no cover
+        pytest.skip('inotify is only available on linux')
+
+    class Libc:
+        def __init__(self, *args, **kwargs):
+            self.inotify_add_watch = None
+
+        def inotify_init1(self, flags):
+            return -1
+
+    monkeypatch.setattr(ctypes, 'CDLL', Libc)
+    with pytest.raises(OSError):
+        InotifyWatcher(('.',))